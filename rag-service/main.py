@@ -3,13 +3,16 @@
 import os
 import sys
 import json
+import time
 import asyncio
+import anyio
 import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
@@ -20,21 +23,36 @@ sys.path.insert(0, str(Path(__file__).parent))
 load_dotenv()
 load_dotenv(Path(__file__).parent.parent / ".env")
 
-class NumpyEncoder(json.JSONEncoder):
-    """处理 numpy 类型的 JSON 编码器"""
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
+# orjson 在 C 层直接序列化 numpy 标量/数组，NaN 输出为 null；未安装时回退标准库 + _sanitize
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def _orjson_default(obj):
+        """orjson 不能原生序列化的对象（如 object 类型数组）"""
         if isinstance(obj, np.ndarray):
             return obj.tolist()
-        return super().default(obj)
+        raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+    def json_dumps(obj) -> bytes:
+        """带 numpy 支持的 JSON 序列化（UTF-8 字节）"""
+        return orjson.dumps(obj, default=_orjson_default, option=_ORJSON_OPTIONS)
+else:
+    def json_dumps(obj) -> bytes:
+        """带 numpy 支持的 JSON 序列化（UTF-8 字节）"""
+        return json.dumps(_sanitize(obj), ensure_ascii=False).encode()
+
 
+# SSE 文本块合帧：距上次发送超过该间隔（秒）或累计块数达到上限时，将连续的 chunk 合并为一帧发送
+_SSE_CHUNK_INTERVAL = 0.02
+_SSE_CHUNK_MAX = 16
 
-def json_dumps(obj) -> str:
-    """带 numpy 支持的 JSON 序列化"""
-    return json.dumps(obj, ensure_ascii=False, cls=NumpyEncoder)
+# 语义回答缓存的查询 embedding 线程池：与 RAG 流水线并发计算，不占用流水线线程
+_ANSWER_CACHE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='answer-cache')
 
 
 app = FastAPI(title="Hotel Review RAG API", version="1.0.0")
@@ -61,8 +79,6 @@ class ChatRequest(BaseModel):
 @app.on_event("startup")
 async def startup():
     """启动时初始化 RAG 系统"""
-    global rag_system
-
     api_key = os.getenv("DASHSCOPE_API_KEY")
     intl_api_key = os.getenv("DASHSCOPE_INTL_API_KEY")
     dashvector_api_key = os.getenv("DASHVECTOR_API_KEY")
@@ -72,6 +88,17 @@ async def startup():
         print("WARNING: 缺少 API Key 环境变量，RAG 系统未初始化")
         return
 
+    # 拉取评论数据、加载索引等初始化耗时较长，放到后台线程执行，服务先行就绪：
+    # 初始化完成前 health 返回 rag_ready=false，chat 返回 503
+    asyncio.get_running_loop().run_in_executor(
+        None, _init_rag_system, api_key, intl_api_key, dashvector_api_key, dashvector_endpoint
+    )
+
+
+def _init_rag_system(api_key, intl_api_key, dashvector_api_key, dashvector_endpoint):
+    """构建 RAG 系统单例（在线程池中运行）"""
+    global rag_system
+
     try:
         from modules.rag_system import HotelReviewRAG
         from modules.clients import DASHSCOPE_INTL_API_BASE
@@ -136,60 +163,123 @@ async def chat(request: ChatRequest):
                 for s in result['references']['summaries']
             ]
 
-            return JSONResponse(content=_sanitize({
+            return Response(content=json_dumps({
                 "references": {
                     "comments": comments,
                     "summaries": summaries
                 },
                 "timing": result['timing']
-            }))
+            }), media_type="application/json")
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
     # 流式：SSE 响应
-    # 使用 asyncio.Queue + 线程池，避免同步生成器阻塞事件循环导致 SSE 缓冲
-    queue: asyncio.Queue = asyncio.Queue()
-    _SENTINEL = object()
+    # 同步 RAG 流水线在线程池中运行，事件经有界 anyio 内存流线程安全地交给事件循环：
+    # 缓冲满时工作线程阻塞（背压），客户端断开后接收端关闭，工作线程随即停止
+    send_stream, receive_stream = anyio.create_memory_object_stream(max_buffer_size=32)
 
+    request_start = time.monotonic()
+    loop = asyncio.get_running_loop()
     query_text = request.query.strip()
     query_options = {k: v for k, v in request.options.items() if k != "enable_generation"}
     query_history = request.history
 
-    def _run_query_stream():
-        """在线程池中运行同步 RAG 流水线，通过 queue 推送事件"""
+    # 语义回答缓存：仅缓存无多轮上下文的问答。查询 embedding 与流水线（意图识别及预先提交的检测/扩展）并发计算，
+    # 流水线发出意图识别结果后按 (意图识别结果, 查询选项) 查找：相似问题意图一致才算命中。
+    # 命中时停止流水线，回放缓存帧并按本次请求重建 done 帧；未命中时记录意图之后推送的帧，正常结束后写入缓存。
+    # 查找结果以 cache 事件紧随 intent 事件发送，响应头与首个 status 帧不等待查找
+    answer_cache = getattr(rag_system, "answer_cache", None)
+    use_answer_cache = answer_cache is not None and not query_history
+
+    def _run_query_stream(embed_future):
+        """在线程池中运行同步 RAG 流水线，逐个事件推送到内存流（连续文本块合帧发送）"""
+        pending_chunks = []
+        last_chunk_sent = 0.0
+        cache_vector = cache_key = None
+        tail_frames = []         # 意图事件之后推送的帧，未命中时写入缓存
+        done_data = None
+        completed = False
+
+        def send(frame):
+            asyncio.run_coroutine_threadsafe(send_stream.send(frame), loop).result()
+
+        def push(event):
+            frame = b"data: " + json_dumps(event) + b"\n\n"
+            send(frame)
+            tail_frames.append(frame)
+
+        def flush_chunks():
+            nonlocal last_chunk_sent
+            if pending_chunks:
+                push({"type": "chunk", "content": "".join(pending_chunks)})
+                pending_chunks.clear()
+                last_chunk_sent = time.monotonic()
+
+        stream = rag_system.query_stream(
+            query_text, enable_hyde=False, history=query_history, **query_options
+        )
         try:
-            for event in rag_system.query_stream(
-                query_text, enable_hyde=False, history=query_history, **query_options
-            ):
+            for event in stream:
                 event_type = event.get("type")
 
-                if event_type == "intent":
-                    queue.put_nowait(f"data: {json_dumps(event)}\n\n")
-                elif event_type == "references":
+                if event_type == "chunk":
+                    # 首块立即发送；之后按时间/块数节流合帧
+                    pending_chunks.append(event["content"])
+                    if (len(pending_chunks) >= _SSE_CHUNK_MAX
+                            or time.monotonic() - last_chunk_sent >= _SSE_CHUNK_INTERVAL):
+                        flush_chunks()
+                    continue
+
+                flush_chunks()
+                if event_type == "references":
                     data = event["data"]
                     data["comments"] = _format_comments(data["comments"])
-                    queue.put_nowait(f"data: {json_dumps(_sanitize(event))}\n\n")
-                elif event_type == "chunk":
-                    queue.put_nowait(f"data: {json_dumps(event)}\n\n")
+                if event_type in ("status", "intent", "references", "done"):
+                    push(event)
+
+                if event_type == "intent" and embed_future is not None:
+                    cached, cache_vector, cache_key = _lookup_answer(
+                        answer_cache, embed_future, event["data"]["need_retrieval"], query_options
+                    )
+                    send(b"data: " + json_dumps({"type": "cache", "data": {"hit": cached is not None}}) + b"\n\n")
+                    if cached is not None:
+                        stream.close()
+                        cached_frames, cached_done = cached
+                        for frame in cached_frames:
+                            send(frame)
+                        timing = {"answer_cache_hit": True, "total": time.monotonic() - request_start}
+                        send(b"data: " + json_dumps({"type": "done", "data": {**cached_done, "timing": timing}}) + b"\n\n")
+                        return
+                    tail_frames.clear()
                 elif event_type == "done":
-                    queue.put_nowait(f"data: {json_dumps(_sanitize(event))}\n\n")
+                    # done 帧的耗时只属于本次请求，缓存其余字段，命中时重建
+                    done_data = {k: v for k, v in event["data"].items() if k != "timing"}
+
+            flush_chunks()
+            completed = True
 
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            pass
         except Exception as e:
-            error_event = {"type": "error", "message": str(e)}
-            queue.put_nowait(f"data: {json_dumps(error_event)}\n\n")
+            try:
+                flush_chunks()
+                push({"type": "error", "message": str(e)})
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                pass
         finally:
-            queue.put_nowait(_SENTINEL)
+            stream.close()
+            loop.call_soon_threadsafe(send_stream.close)
+            if completed and cache_key is not None and done_data is not None:
+                answer_cache.put(cache_vector, cache_key, (tail_frames[:-1], done_data))
 
     async def generate_sse():
-        """异步生成器：从 queue 取出 SSE 事件并 yield"""
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(None, _run_query_stream)
+        """异步生成器：开始推流时启动流水线（响应未发出即断开时不启动），从内存流取出 SSE 事件并 yield"""
+        embed_future = _ANSWER_CACHE_POOL.submit(answer_cache.embed, query_text) if use_answer_cache else None
+        loop.run_in_executor(None, _run_query_stream, embed_future)
 
-        while True:
-            item = await queue.get()
-            if item is _SENTINEL:
-                break
-            yield item
+        async with receive_stream:
+            async for frame in receive_stream:
+                yield frame
 
     return StreamingResponse(
         generate_sse(),
@@ -202,8 +292,22 @@ async def chat(request: ChatRequest):
     )
 
 
+def _lookup_answer(answer_cache, embed_future, need_retrieval: bool, query_options: dict) -> tuple:
+    """
+    等待查询 embedding 并查找语义回答缓存，返回 (命中值或 None, 查询向量, 缓存键)
+
+    缓存键包含意图识别结果：相似度达到阈值但意图不同的问题不复用回答；embedding 失败时不走缓存
+    """
+    try:
+        vector = embed_future.result()
+    except Exception:
+        return None, None, None
+    key = repr((need_retrieval, sorted(query_options.items())))
+    return answer_cache.get(vector, key), vector, key
+
+
 def _sanitize(obj):
-    """递归将 numpy 类型转换为 Python 原生类型"""
+    """递归将 numpy 类型转换为 Python 原生类型（仅在未安装 orjson 时使用）"""
     if isinstance(obj, dict):
         return {k: _sanitize(v) for k, v in obj.items()}
     if isinstance(obj, list):
@@ -222,23 +326,35 @@ def _sanitize(obj):
     return obj
 
 
+# _format_comments 需从 df_comments 补充的字段
+_FULL_DATA_COLUMNS = ('star', 'travel_type', 'category1', 'category2', 'category3', 'images')
+
+
+def _lookup_full_data(comment_ids: list) -> dict:
+    """从 rag_system 的 df_comments 一次性取出全部评论的补充字段：{comment_id: {列: 值}}"""
+    if not rag_system:
+        return {}
+    try:
+        df = rag_system.df_comments
+        columns = [col for col in _FULL_DATA_COLUMNS if col in df.columns]
+        ids = [cid for cid in dict.fromkeys(comment_ids) if cid and cid in df.index]
+        if not ids:
+            return {}
+        return dict(zip(ids, df.loc[ids, columns].to_dict(orient='records')))
+    except Exception:
+        return {}
+
+
 def _format_comments(raw_comments: list) -> list:
     """将 RAG 返回的评论格式转换为前端 Comment 类型"""
     formatted = []
+    full_data_by_id = _lookup_full_data([c.get('comment_id', '') for c in raw_comments])
     for i, c in enumerate(raw_comments):
         meta = c.get('metadata', {})
         comment_id = c.get('comment_id', '')
+        full_data = full_data_by_id.get(comment_id, {})
 
-        # 从 rag_system 的 df_comments 获取完整数据
-        full_data = {}
-        if rag_system and comment_id:
-            try:
-                row = rag_system.df_comments.loc[comment_id]
-                full_data = row.to_dict() if hasattr(row, 'to_dict') else {}
-            except (KeyError, Exception):
-                pass
-
-        formatted.append(_sanitize({
+        formatted.append({
             "_id": str(comment_id),
             "comment": str(c.get('comment', '')),
             "score": meta.get('score', 0),
@@ -256,10 +372,12 @@ def _format_comments(raw_comments: list) -> list:
             "images": full_data.get('images', []),
             "relevance_score": c.get('final_score', c.get('rrf_score', 0)),
             "rank": c.get('final_rank', c.get('rrf_rank', i + 1))
-        }))
+        })
     return formatted
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvicorn[standard] 自带 uvloop/httptools，"auto" 下已优先选用（Windows 无 uvloop 时回退 asyncio）；
+    # 加长 keep-alive，前端轮询与 SSE 连接可复用
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto", timeout_keep_alive=75)
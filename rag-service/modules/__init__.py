@@ -1,7 +1,8 @@
 from modules.clients import LLMClient, EmbeddingClient
 from modules.index import InvertedIndex
 from modules.intent import IntentRecognizer, IntentDetector, IntentExpander, HyDEGenerator
-from modules.retriever import HybridRetriever
-from modules.ranker import Reranker, MultiFactorRanker
+from modules.retriever import HybridRetriever, RetrievalCandidates
+from modules.ranker import Reranker, MultiFactorRanker, CorpusFeatures
 from modules.generator import ResponseGenerator
+from modules.answer_cache import SemanticAnswerCache
 from modules.rag_system import HotelReviewRAG
@@ -0,0 +1,64 @@
+"""语义回答缓存：按问题 embedding 的余弦相似度复用近期回答"""
+
+import time
+import threading
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    语义回答缓存：近期问题的单位化 embedding 存于定长矩阵（环形覆盖最旧条目），
+    查询时一次矩阵-向量乘求全部余弦相似度，超过阈值且选项键一致、未过期的条目视为命中
+    """
+
+    def __init__(self, embedding_client, threshold: float = 0.95, max_entries: int = 1000,
+                 ttl: float = 3600, clock=time.monotonic):
+        self.embedding_client = embedding_client
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock      # 过期判断用的单调时钟，可注入以便测试
+        self._vectors = None
+        # 与 _vectors 行对齐：(key, 写入时间, value)
+        self._entries = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def embed(self, query: str) -> np.ndarray:
+        """问题文本 -> 单位化 float32 向量"""
+        vector = np.asarray(self.embedding_client.embed_batch([query])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, vector: np.ndarray, key):
+        """查找与 vector 最相似且 key 一致的未过期条目，未命中返回 None"""
+        now = self._clock()
+        with self._lock:
+            if not self._size:
+                return None
+            similarities = self._vectors[:self._size] @ vector
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            for row in candidates[np.argsort(-similarities[candidates])].tolist():
+                entry_key, written, value = self._entries[row]
+                if entry_key == key and now - written <= self.ttl:
+                    return value
+        return None
+
+    def put(self, vector: np.ndarray, key, value):
+        """写入条目，满时覆盖最旧条目"""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            row = self._next
+            self._vectors[row] = vector
+            self._entries[row] = (key, self._clock(), value)
+            self._next = (row + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries = [None] * self.max_entries
+            self._size = 0
+            self._next = 0
@@ -1,10 +1,32 @@
 """LLM 与 Embedding 客户端封装"""
 
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import requests
 from dashscope import Generation, TextEmbedding
 
 # DashScope 新加坡端点
 DASHSCOPE_INTL_API_BASE = "https://dashscope-intl.aliyuncs.com/api/v1"
 
+# 进程内共享的 DashScope HTTP 会话（keep-alive 连接复用）：
+# 检索、HyDE、Rerank 分片的并发请求远超 SDK 默认连接池（10），池满后多余连接用完即弃、下次调用重新握手，
+# 这里将连接池放大到与各线程池并发度相当
+HTTP_POOL_SIZE = 64
+
+
+def _create_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+HTTP_SESSION = _create_http_session()
+
 
 class LLMClient:
     """Qwen 客户端封装"""
@@ -22,7 +44,8 @@ class LLMClient:
             prompt=prompt,
             temperature=temperature,
             result_format="message",
-            response_format={"type": "json_object"} if self.json else None
+            response_format={"type": "json_object"} if self.json else None,
+            session=HTTP_SESSION
         )
 
         if response.status_code == 200:
@@ -34,18 +57,113 @@ class LLMClient:
 class EmbeddingClient:
     """文本嵌入客户端封装"""
 
-    def __init__(self, api_key: str, model: str = "text-embedding-v4", dimension: int = 1024):
+    def __init__(self, api_key: str, model: str = "text-embedding-v4", dimension: int = 1024,
+                 batch_size: int = 10, cache_size: int = 4096, cache_ttl: float | None = None,
+                 batch_window: float = 0.005):
         self.api_key = api_key
         self.model = model
         self.dimension = dimension
+        # 单次请求的文本条数上限（text-embedding-v4 为 10），超出时分片并发请求
+        self.batch_size = batch_size
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='embedding')
+        # 文本 -> embedding 的 LRU 缓存：{text: (写入时间, embedding)}，cache_ttl 为 None 时不过期
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # 微批：并发查询的未命中文本在 batch_window 秒内汇合为同一批请求（0 表示不合批）
+        self.batch_window = batch_window
+        self._pending = []
+        self._pending_lock = threading.Lock()
+
+    def stats(self) -> dict:
+        """缓存统计"""
+        with self._cache_lock:
+            return {'hits': self._hits, 'misses': self._misses, 'size': len(self._cache)}
 
     def embed_batch(self, texts: list[str]) -> list[list[float]]:
-        """批量生成 embedding"""
+        """批量生成 embedding（命中缓存的文本不再请求，其余分片并发请求，结果保持输入顺序）"""
+        if self.cache_size <= 0:
+            return self._embed_coalesced(texts)
+
+        now = time.monotonic()
+        embeddings = [None] * len(texts)
+        missing = {}
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                entry = self._cache.get(text)
+                if entry is not None and (self.cache_ttl is None or now - entry[0] <= self.cache_ttl):
+                    self._cache.move_to_end(text)
+                    embeddings[i] = entry[1]
+                    self._hits += 1
+                else:
+                    missing.setdefault(text, []).append(i)
+            self._misses += len(missing)
+
+        if missing:
+            missing_texts = list(missing)
+            fetched = self._embed_coalesced(missing_texts)
+            with self._cache_lock:
+                for text, embedding in zip(missing_texts, fetched):
+                    self._cache[text] = (now, embedding)
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            for text, embedding in zip(missing_texts, fetched):
+                for i in missing[text]:
+                    embeddings[i] = embedding
+        return embeddings
+
+    def _embed_coalesced(self, texts: list[str]) -> list[list[float]]:
+        """
+        微批合并：窗口内首个到达的线程作为 leader 等待 batch_window 秒，
+        将期间其他线程提交的文本去重合并后统一请求，再按各自顺序分发结果
+        """
+        if self.batch_window <= 0:
+            return self._embed_chunks(texts)
+
+        future = Future()
+        with self._pending_lock:
+            is_leader = not self._pending
+            self._pending.append((texts, future))
+        if not is_leader:
+            return future.result()
+
+        time.sleep(self.batch_window)
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+
+        unique_texts = list(dict.fromkeys(text for batch_texts, _ in batch for text in batch_texts))
+        try:
+            embeddings = dict(zip(unique_texts, self._embed_chunks(unique_texts)))
+        except Exception as e:
+            for _, pending_future in batch:
+                pending_future.set_exception(e)
+        else:
+            for batch_texts, pending_future in batch:
+                pending_future.set_result([embeddings[text] for text in batch_texts])
+        return future.result()
+
+    def _embed_chunks(self, texts: list[str]) -> list[list[float]]:
+        """超过单次上限时分片并发请求，结果保持输入顺序"""
+        if len(texts) <= self.batch_size:
+            return self._embed(texts)
+        chunks = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        futures = [self._pool.submit(self._embed, chunk) for chunk in chunks[1:]]
+        embeddings = self._embed(chunks[0])
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
         response = TextEmbedding.call(
             api_key=self.api_key,
             model=self.model,
             input=texts,
-            dimension=self.dimension
+            dimension=self.dimension,
+            session=HTTP_SESSION
         )
 
         if response.status_code == 200:
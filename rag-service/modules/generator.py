@@ -1,9 +1,46 @@
 """回复生成器：基于检索上下文生成最终回复"""
 
+import sys
 import time
 from datetime import datetime
 from dashscope import Generation
 
+from modules.clients import HTTP_SESSION
+
+
+# 终端打印的刷新节流：距上次刷新超过该间隔（秒）或缓冲超过该字节数时才 flush
+_FLUSH_INTERVAL = 0.05
+_FLUSH_BYTES = 256
+
+
+# Prompt 中的固定说明段落：模块加载时构建一次，构建 prompt 时直接引用
+_DIRECT_ANSWER_RULES = """请直接回答用户的问题。注意：
+- 如果是问候或闲聊，友好回应
+- 如果是通用问题，给出简洁准确的回答
+- 如果用户的问题是对上一轮对话的追问，请结合上下文理解用户意图
+- 语气要亲切专业
+- 使用Markdown格式输出，不得出现 "```markdown", "```" 标记"""
+
+_SUMMARY_NOTE = """
+注意：评论摘要是用来给到你更丰富的概览信息的，但用户只能看到【相关用户评论】的引用而看不到摘要的引用，因此在回复中你可以给出摘要中的模糊信息，\
+但**不得过于精确因为用户无法溯源**，也**不得告诉用户你引用了摘要**，**更不得将其当作评论引用输出"评论x"**。若摘要中的信息与用户问题无关，直接忽略即可，**不需要**做出任何额外说明。
+"""
+
+_ANSWER_RULES = """【回答要求】
+1. 综合以上评论信息，给出客观、全面的回答
+2. 回答要有条理，突出重点
+3. 如有正面和负面评价，都要提及，保持客观。注意给出的参考评论并不代表所有，切忌以偏概全给出"绝对化"的表述
+4. 语气要专业、亲切
+5. 回答长度适中，不要过于冗长
+6. 不得大段或连续照抄用户评论，严禁全文都在引用用户评论却并没有思考提炼总结。相似内容能合并就合并，不要分开引用（合并后注意不得同时列出超过3条参考评论，使用"等"替代）
+7. 一般来说越靠前的评论，其重要性越高，但你也可以自行判断自行选择
+8. 不得在回复中罗列用户评论的具体日期，但当用户问题时效性敏感时，可以大致提一下参考评论的时间范围；当用户未表现出明显时效性需求时不要强行给出具体时间
+9. 引用【相关用户评论】中某一条评论独特内容时，应使用引用标记 [[ref:N]]（N为评论序号）标注来源（**仅标注非常确定的引用，模棱两可的引用不要标注，务必保证引用序号绝对正确**），供用户参考；但针对参考评论总体（如"多数住客……"等内容）或【xx类别摘要】进行归纳总结时**无需**标注。引用标记示例：某某服务很好[[ref:2]]。不要在标记外面加任何括号或其他包裹符号
+10. 不得同时列出超过3条引用，即最多 [[ref:1,3,5]]。如需同时引用超过3条评论，则应只保留排名最靠前的2条并加"等"字，输出形式为 [[ref:1,3]]等。注意多条引用写在同一个标记内用逗号分隔，如 [[ref:1,3]]，而不是 [[ref:1]][[ref:3]]
+11. 如果评论信息不足以回答问题，诚实说明
+12. 所有的回复必须仅依赖检索到的用户评论及摘要，不得出现自作主张的幻觉回复，例如帮用户查询酒店今日客房剩余、当前酒店相关活动推荐等一律不允许出现。你并没有接入酒店内部API无法完成这些事情因此禁止在回复中出现此类幻觉信息
+13. 使用Markdown格式输出，不得出现 "```markdown", "```" 标记"""
+
 
 class ResponseGenerator:
     """回复生成器：基于检索上下文生成最终回复"""
@@ -11,6 +48,8 @@ class ResponseGenerator:
     def __init__(self, api_key: str, model: str = "qwen-plus"):
         self.api_key = api_key
         self.model = model
+        # (日期, "Y年M月D日")：日期不变时复用格式化结果；元组整体读取、整体赋值，并发读写无需加锁
+        self._date_cache = (None, None)
 
     def _build_prompt(self, user_query: str, rewritten_queries=None,
                       ranked_comments=None, summaries=None,
@@ -35,32 +74,28 @@ class ResponseGenerator:
 
 用户问题：{user_query}
 
-请直接回答用户的问题。注意：
-- 如果是问候或闲聊，友好回应
-- 如果是通用问题，给出简洁准确的回答
-- 如果用户的问题是对上一轮对话的追问，请结合上下文理解用户意图
-- 语气要亲切专业
-- 使用Markdown格式输出，不得出现 "```markdown", "```" 标记
+{_DIRECT_ANSWER_RULES}
 """
 
-        if not today:
-            today = datetime.today()
-        date = f"{today.year}年{today.month}月{today.day}日"
+        day = (today or datetime.today()).date()
+        cached_day, date = self._date_cache
+        if day != cached_day:
+            date = f"{day.year}年{day.month}月{day.day}日"
+            self._date_cache = (day, date)
 
         # 构建改写 Query 上下文
         queries_context = ""
         if rewritten_queries:
-            queries_context += "【问题解析】\n系统识别到用户可能关注以下方面：\n"
-            queries_context += "\n".join(
-                [f"- {q['query']}（意图权重为{q['weight']}）" for q in rewritten_queries]
+            queries_context = (
+                "【问题解析】\n系统识别到用户可能关注以下方面：\n"
+                + "\n".join(f"- {q['query']}（意图权重为{q['weight']}）" for q in rewritten_queries)
+                + "\n注意：权重信息是用来帮助你区分意图主次的，**不得**向用户输出权重相关信息。"
             )
-            queries_context += "\n注意：权重信息是用来帮助你区分意图主次的，**不得**向用户输出权重相关信息。"
 
         # 构建评论上下文
         if ranked_comments:
-            comments_context = "【相关用户评论】\n"
-            for i, c in enumerate(ranked_comments, 1):
-                comments_context += f"""
+            # 各段先收集再一次性 join，避免循环内 += 反复拷贝字符串
+            comments_context = "【相关用户评论】\n" + "".join(f"""
 【评论{i}】
 评分: {c['metadata']['score']}（满分5分）
 发布日期: {c['metadata']['publish_date']}
@@ -68,24 +103,18 @@ class ResponseGenerator:
 点赞数: {c['metadata']['useful_count']}
 评论数: {c['metadata']['review_count']}
 房型: {c['metadata']['room_type']}
-"""
+""" for i, c in enumerate(ranked_comments, 1))
         else:
             comments_context = "【未检索到相关用户评论】\n"
 
         # 构建摘要上下文
         summaries_context = ""
         if summaries:
-            summaries_context += "【相关评论摘要】\n"
-            for s in summaries:
-                summaries_context += f"""
+            summaries_context = "【相关评论摘要】\n" + "".join(f"""
 【{s['metadata']['category']}类别摘要】
 关键词: {s['metadata']['keywords']}
 摘要: {s['summary']}
-"""
-            summaries_context += """
-注意：评论摘要是用来给到你更丰富的概览信息的，但用户只能看到【相关用户评论】的引用而看不到摘要的引用，因此在回复中你可以给出摘要中的模糊信息，\
-但**不得过于精确因为用户无法溯源**，也**不得告诉用户你引用了摘要**，**更不得将其当作评论引用输出"评论x"**。若摘要中的信息与用户问题无关，直接忽略即可，**不需要**做出任何额外说明。
-"""
+""" for s in summaries) + _SUMMARY_NOTE
 
         return f"""
 你是广州花园酒店的智能客服助手，需要基于用户评论为用户提供准确、高质量、有帮助、简洁的回答。
@@ -102,20 +131,7 @@ class ResponseGenerator:
 
 {summaries_context}
 
-【回答要求】
-1. 综合以上评论信息，给出客观、全面的回答
-2. 回答要有条理，突出重点
-3. 如有正面和负面评价，都要提及，保持客观。注意给出的参考评论并不代表所有，切忌以偏概全给出"绝对化"的表述
-4. 语气要专业、亲切
-5. 回答长度适中，不要过于冗长
-6. 不得大段或连续照抄用户评论，严禁全文都在引用用户评论却并没有思考提炼总结。相似内容能合并就合并，不要分开引用（合并后注意不得同时列出超过3条参考评论，使用"等"替代）
-7. 一般来说越靠前的评论，其重要性越高，但你也可以自行判断自行选择
-8. 不得在回复中罗列用户评论的具体日期，但当用户问题时效性敏感时，可以大致提一下参考评论的时间范围；当用户未表现出明显时效性需求时不要强行给出具体时间
-9. 引用【相关用户评论】中某一条评论独特内容时，应使用引用标记 [[ref:N]]（N为评论序号）标注来源（**仅标注非常确定的引用，模棱两可的引用不要标注，务必保证引用序号绝对正确**），供用户参考；但针对参考评论总体（如"多数住客……"等内容）或【xx类别摘要】进行归纳总结时**无需**标注。引用标记示例：某某服务很好[[ref:2]]。不要在标记外面加任何括号或其他包裹符号
-10. 不得同时列出超过3条引用，即最多 [[ref:1,3,5]]。如需同时引用超过3条评论，则应只保留排名最靠前的2条并加"等"字，输出形式为 [[ref:1,3]]等。注意多条引用写在同一个标记内用逗号分隔，如 [[ref:1,3]]，而不是 [[ref:1]][[ref:3]]
-11. 如果评论信息不足以回答问题，诚实说明
-12. 所有的回复必须仅依赖检索到的用户评论及摘要，不得出现自作主张的幻觉回复，例如帮用户查询酒店今日客房剩余、当前酒店相关活动推荐等一律不允许出现。你并没有接入酒店内部API无法完成这些事情因此禁止在回复中出现此类幻觉信息
-13. 使用Markdown格式输出，不得出现 "```markdown", "```" 标记
+{_ANSWER_RULES}
 
 用户问题：{user_query}
 
@@ -131,7 +147,8 @@ class ResponseGenerator:
             temperature=temperature,
             result_format="message",
             stream=True,
-            incremental_output=True
+            incremental_output=True,
+            session=HTTP_SESSION
         )
 
     def generate(self, user_query: str, rewritten_queries=None, ranked_comments=None,
@@ -143,16 +160,17 @@ class ResponseGenerator:
         返回:
             (response_text, ttft_model, subsequent_time, generation_time)
         """
-        start_time = time.time()
+        start_time = time.monotonic()
         prompt = self._build_prompt(user_query, rewritten_queries, ranked_comments,
                                     summaries, need_retrieval, today, history)
 
         completion = Generation.call(**self._call_kwargs(prompt))
 
-        response_content = ""
+        response_parts = []
         ttft_model = 0
         subsequent_time = 0
-        first_token_time = 0
+        last_flush = start_time
+        pending = 0
 
         for chunk in completion:
             if chunk.status_code != 200:
@@ -161,19 +179,26 @@ class ResponseGenerator:
             message = chunk.output.choices[0].message
             if message.content:
                 if not ttft_model:
-                    ttft_model = time.time() - start_time
-                    first_token_time = time.time()
+                    ttft_model = time.monotonic() - start_time
                 if print_response:
-                    print(message.content, end="", flush=True)
-                response_content += message.content
-
+                    # 写入缓冲区，按时间/字节数节流 flush，避免每个 token 一次系统调用
+                    sys.stdout.write(message.content)
+                    pending += len(message.content)
+                    now = time.monotonic()
+                    if pending > _FLUSH_BYTES or now - last_flush > _FLUSH_INTERVAL:
+                        sys.stdout.flush()
+                        last_flush = now
+                        pending = 0
+                response_parts.append(message.content)
+
+        response_content = "".join(response_parts)
         if print_response and response_content:
-            print()
+            print(flush=True)
 
+        generation_time = time.monotonic() - start_time
         if ttft_model:
-            subsequent_time = time.time() - first_token_time
-
-        generation_time = time.time() - start_time
+            # 首 token 时刻即 start_time + ttft_model，无需另行取时
+            subsequent_time = generation_time - ttft_model
 
         return response_content, ttft_model, subsequent_time, generation_time
 
@@ -1,17 +1,105 @@
 """基于 BM25 的倒排索引"""
 
+import os
 import re
-import math
+import json
+import functools
+import threading
 import nltk
-import jieba
 import pickle
+import numpy as np
 from pathlib import Path
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# 在 Jupyter 中显示 notebook 进度条，脚本/测试中回退为终端进度条
+from tqdm.auto import tqdm
+
+# jieba_fast 为 jieba 的 C 扩展实现，接口与分词结果一致
+try:
+    import jieba_fast as jieba
+except ImportError:
+    import jieba
 
 try:
-    from tqdm.notebook import tqdm
+    from numba import njit
 except ImportError:
-    from tqdm import tqdm
+    njit = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# zstd 帧魔数，用于加载时识别压缩格式
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# zip 本地文件头魔数：.npz 列式格式
+_ZIP_MAGIC = b'PK\x03\x04'
+
+
+def _accumulate_bm25(doc_idxs, weights, scale, scores):
+    """单个词项的 BM25 累加内核：scores[d] += scale * weight(t, d)"""
+    for i in range(doc_idxs.size):
+        scores[doc_idxs[i]] += scale * weights[i]
+
+
+# 安装 numba 时编译为无临时数组的标量循环，否则走 NumPy 向量化路径
+if njit is not None:
+    _accumulate_bm25 = njit(cache=True, fastmath=True)(_accumulate_bm25)
+
+# 进程级 jieba 词典加载标记：多个 InvertedIndex 实例共享同一份词典
+_jieba_initialized = False
+_jieba_lock = threading.Lock()
+
+
+def _init_jieba():
+    """预加载 jieba 词典（每个进程仅执行一次）"""
+    global _jieba_initialized
+    if _jieba_initialized:
+        return
+    with _jieba_lock:
+        if not _jieba_initialized:
+            jieba.initialize()
+            _jieba_initialized = True
+
+
+# 非中英文字符（含数字、标点）；预先绑定 search 方法，省去逐词项的属性查找
+_NON_WORD_PATTERN = re.compile(r'[^\u4e00-\u9fffa-zA-Z]')
+_has_non_word = _NON_WORD_PATTERN.search
+
+
+def _tokenize(text: str, stopwords: frozenset) -> list[str]:
+    """分词与过滤"""
+    # 删除空白字符（与 re.sub(r"\s+", "", text) 等价但更快）
+    text = ''.join(text.split())
+    # 中文分词
+    tokens = jieba.lcut(text)
+    # 过滤停用词、非中英文字符，统一小写
+    return [
+        lowered for token, lowered in zip(tokens, map(str.lower, tokens))
+        if lowered not in stopwords and not _has_non_word(token)
+    ]
+
+
+@functools.lru_cache(maxsize=4096)
+def _tokenize_cached(text: str, stopwords: frozenset) -> tuple[str, ...]:
+    """查询分词缓存：会话内改写 Query 重复率高，返回不可变元组以便复用"""
+    return tuple(_tokenize(text, stopwords))
+
+
+# 分词子进程持有的停用词，由 _init_tokenize_worker 设置
+_worker_stopwords = frozenset()
+
+
+def _init_tokenize_worker(stopwords: frozenset):
+    """分词子进程初始化：保存停用词并预加载 jieba 词典"""
+    global _worker_stopwords
+    _worker_stopwords = stopwords
+    _init_jieba()
+
+
+def _tokenize_in_worker(text: str) -> list[str]:
+    return _tokenize(text, _worker_stopwords)
 
 
 class InvertedIndex:
@@ -25,11 +113,23 @@ class InvertedIndex:
         """
         self.k1 = k1
         self.b = b
-        self.index = {}          # {term: {doc_id: term_freq}}
-        self.doc_lengths = {}    # {doc_id: doc_length}
+        # CSR 倒排表：词项 t 的倒排记录位于 [term_offsets[t], term_offsets[t + 1])，全部词项共用连续数组
+        self.vocab = {}          # {term: term_id}
+        self.term_offsets = np.zeros(1, dtype=np.int64)
+        self.posting_doc_idxs = np.zeros(0, dtype=np.int32)    # 倒排记录的文档内部编号
+        self.posting_tfs = np.zeros(0, dtype=np.uint8)         # 倒排记录的词频（按最大词频取 uint8/uint16/uint32）
+        self.posting_weights = np.zeros(0, dtype=np.float32)   # 倒排记录的 BM25 贡献，idf 与长度归一化已折算
+        self.doc_ids = []        # [doc_id]，文档内部编号 -> doc_id
+        self.doc_lengths = np.zeros(0, dtype=np.float32)  # 按内部编号排列的文档长度
         self.avg_doc_length = 0
         self.num_docs = 0
         self.documents = {}      # {doc_id: document_content}
+        self.idf = np.zeros(0)   # 按 term_id 排列的 idf，语料固定，构建时预计算
+        self.max_score = np.zeros(0, dtype=np.float32)  # 按 term_id 排列的词项最大 BM25 贡献，用于 MaxScore 剪枝
+        self._offset_list = [0]                         # term_offsets / max_score 的 Python 列表副本，供逐词项取用
+        self._max_score_list = []
+        self._norm = np.zeros(0, dtype=np.float32)        # 文档长度归一化项 k1 * (1 - b + b * dl / avgdl)
+        self.version = 0         # 倒排表每次重建/加载后递增，供上层缓存判断失效
 
         # 加载停用词
         self.stopwords = set()
@@ -40,51 +140,110 @@ class InvertedIndex:
                 self.stopwords.update(nltk.corpus.stopwords.words('english'))
             except Exception:
                 print("警告: 未能加载 NLTK 英文停用词")
+        self.stopwords = frozenset(self.stopwords)
 
         # 字典预加载
-        jieba.initialize()
+        _init_jieba()
 
     def tokenize(self, text: str) -> list[str]:
         """分词与过滤"""
-        # 删除空白字符
-        text = re.sub(r'\s+', '', text)
-        # 中文分词
-        tokens = jieba.lcut(text)
-        # 过滤停用词、非中英文字符，统一小写
-        pattern = re.compile(r'[^\u4e00-\u9fffa-zA-Z]')
-        tokens = [
-            token.lower() for token in tokens
-            if token.lower() not in self.stopwords and not pattern.search(token)
-        ]
-        return tokens
-
-    def build(self, documents: dict[str, str]):
+        return _tokenize(text, self.stopwords)
+
+    def build(self, documents: dict[str, str], workers: int = None, keep_documents: bool = True):
         """
         构建倒排索引
 
         参数:
             documents: {doc_id: document_text}
+            workers: 分词进程数，默认为 CPU 核数；为 1 时在当前进程内分词
+            keep_documents: 是否保留原文（检索只用倒排数组；不保留时 save() 写出的索引不含原文）
         """
-        self.documents = documents
-        self.num_docs = len(documents)
-
-        total_length = 0
-        for doc_id, text in tqdm(documents.items(), desc="分词与统计"):
-            tokens = self.tokenize(text)
-            doc_length = len(tokens)
-            self.doc_lengths[doc_id] = doc_length
-            total_length += doc_length
-
-            term_freq = Counter(tokens)
-            for term, freq in term_freq.items():
-                if term not in self.index:
-                    self.index[term] = {}
-                self.index[term][doc_id] = freq
-
-        self.avg_doc_length = total_length / self.num_docs if self.num_docs > 0 else 0
-        print(f"倒排索引构建完成: {len(self.index)} 个词项, {self.num_docs} 篇文档")
+        self.documents = documents if keep_documents else {}
+        self.doc_ids = list(documents)
+        self.num_docs = len(self.doc_ids)
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        postings = {}            # {term: ([doc_idx], [term_freq])}
+        doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+        executor = None
+        if workers > 1:
+            # jieba 分词为 CPU 密集型，使用进程池绕过 GIL；map 保持文档顺序
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_tokenize_worker, initargs=(self.stopwords,)
+            )
+            token_lists = executor.map(_tokenize_in_worker, documents.values(), chunksize=64)
+        else:
+            token_lists = map(self.tokenize, documents.values())
+
+        # setdefault 每次都会新建默认的两个空列表，这里只在词项首次出现时创建
+        get_posting = postings.get
+        try:
+            for doc_idx, tokens in enumerate(tqdm(token_lists, total=self.num_docs, desc="分词与统计")):
+                doc_lengths[doc_idx] = len(tokens)
+
+                for term, freq in Counter(tokens).items():
+                    posting = get_posting(term)
+                    if posting is None:
+                        posting = postings[term] = ([], [])
+                    posting[0].append(doc_idx)
+                    posting[1].append(freq)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = float(doc_lengths.mean()) if self.num_docs > 0 else 0
+        self._set_postings(postings)
+        print(f"倒排索引构建完成: {len(self.vocab)} 个词项, {self.num_docs} 篇文档")
         print(f"平均文档长度: {self.avg_doc_length:.2f} 个词")
 
+    def _set_postings(self, postings: dict, idf: dict = None):
+        """将 {term: (doc_idxs, freqs)} 拼接为 CSR 倒排表"""
+        terms = list(postings)
+        lengths = np.fromiter((len(postings[t][0]) for t in terms), dtype=np.int64, count=len(terms))
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=term_offsets[1:])
+
+        # 词频为整数且通常很小：按最大词频选用能无损容纳的最窄无符号整型（评论中几乎总是 uint8）
+        tfs = np.concatenate([np.asarray(postings[t][1]) for t in terms]) if terms else np.zeros(0)
+        tf_dtype = np.min_scalar_type(int(tfs.max()) if tfs.size else 0)
+        doc_idxs = np.concatenate([np.asarray(postings[t][0], dtype=np.int32) for t in terms]) if terms else np.zeros(0)
+
+        if idf is None:
+            idf = np.log((self.num_docs - lengths + 0.5) / (lengths + 0.5) + 1.0)
+        else:
+            idf = np.asarray([idf[t] for t in terms], dtype=np.float64)
+        self._set_csr(terms, term_offsets, doc_idxs.astype(np.int32), tfs.astype(tf_dtype), idf)
+
+    def _set_csr(self, terms: list, term_offsets: np.ndarray, doc_idxs: np.ndarray,
+                 tfs: np.ndarray, idf: np.ndarray):
+        """设置 CSR 倒排表，并预计算长度归一化项、每条倒排记录的 BM25 贡献与词项最大贡献"""
+        self.vocab = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.posting_doc_idxs = doc_idxs
+        self.posting_tfs = tfs
+        self.idf = idf
+        self.version += 1
+        if self.avg_doc_length > 0:
+            self._norm = (self.k1 * (1 - self.b + self.b * self.doc_lengths / self.avg_doc_length)).astype(np.float32)
+        else:
+            self._norm = np.full(self.num_docs, self.k1, dtype=np.float32)
+
+        # 每条倒排记录的 BM25 贡献 idf * tf * (k1 + 1) / (tf + norm)，整表一次向量化计算；
+        # 词项最大贡献按 CSR 分段取最大值
+        idfs = np.repeat(idf.astype(np.float32), np.diff(term_offsets))
+        tfs = tfs.astype(np.float32)
+        self.posting_weights = (idfs * tfs * (self.k1 + 1) / (tfs + self._norm[doc_idxs])).astype(np.float32)
+        if terms:
+            self.max_score = np.maximum.reduceat(self.posting_weights, term_offsets[:-1])
+        else:
+            self.max_score = np.zeros(0, dtype=np.float32)
+        # 查询时按词项逐个取用，预先转为 Python 列表以避免 NumPy 标量开销
+        self._offset_list = term_offsets.tolist()
+        self._max_score_list = self.max_score.tolist()
+
     def search(self, query: str, topk: int = 10) -> list[tuple[str, float]]:
         """
         BM25 检索
@@ -96,59 +255,188 @@ class InvertedIndex:
         返回:
             [(doc_id, bm25_score), ...]
         """
-        query_tokens = self.tokenize(query)
+        query_tokens = _tokenize_cached(query, self.stopwords)
 
         if not query_tokens:
             return []
 
-        # 计算 IDF
-        idf = {}
-        for term in query_tokens:
-            if term in self.index:
-                df = len(self.index[term])
-                idf[term] = math.log((self.num_docs - df + 0.5) / (df + 0.5) + 1.0)
-
-        # 计算 BM25 分数
-        scores = {}
-        for term in query_tokens:
-            if term not in self.index:
-                continue
-            for doc_id, tf in self.index[term].items():
-                if doc_id not in scores:
-                    scores[doc_id] = 0
-                doc_length = self.doc_lengths[doc_id]
-                norm_factor = 1 - self.b + self.b * (doc_length / self.avg_doc_length)
-                term_score = idf[term] * (tf * (self.k1 + 1)) / (tf + self.k1 * norm_factor)
-                scores[doc_id] = scores.get(doc_id, 0) + term_score
-
-        sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:topk]
-        return sorted_docs
+        # MaxScore：按最大贡献降序处理词项（重复词项按出现次数加权）
+        query_terms = [(self.vocab[term], count) for term, count in Counter(query_tokens).items()
+                       if term in self.vocab]
+        max_score, offsets = self._max_score_list, self._offset_list
+        query_terms.sort(key=lambda x: max_score[x[0]] * x[1], reverse=True)
+        remaining = sum(max_score[term_id] * count for term_id, count in query_terms)
+        remaining_postings = sum(offsets[term_id + 1] - offsets[term_id] for term_id, _ in query_terms)
+
+        # 计算 BM25 分数：按词项对倒排表做向量化累加（同一词项的 doc_idx 互不重复）
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        reachable = None         # 剪枝后仍可能进入 Top-K 的文档掩码
+        for term_id, count in query_terms:
+            remaining -= max_score[term_id] * count
+            start, end = offsets[term_id], offsets[term_id + 1]
+            doc_idxs, weights = self.posting_doc_idxs[start:end], self.posting_weights[start:end]
+            remaining_postings -= len(doc_idxs)
+            if reachable is not None:
+                keep = reachable[doc_idxs]
+                doc_idxs, weights = doc_idxs[keep], weights[keep]
+            if njit is not None:
+                _accumulate_bm25(doc_idxs, weights, np.float32(count), scores)
+            else:
+                scores[doc_idxs] += weights * count
+
+            # 第 K 名得分已超过剩余词项的贡献上界：未命中的文档不可能再进入 Top-K，
+            # 后续词项只需为仍可能达到阈值的文档补全得分（剩余倒排表长于全量文档时才值得检查）
+            if (reachable is None and remaining_postings > self.num_docs
+                    and 0 < topk <= self.num_docs):
+                threshold = np.partition(scores, -topk)[-topk]
+                if threshold > remaining:
+                    reachable = scores + remaining >= threshold
+
+        return self._top_k(scores, topk)
+
+    def search_batch(self, queries: list[str], topk: int = 10) -> list[list[tuple[str, float]]]:
+        """
+        批量 BM25 检索：逐个查询走 search()（numba 累加内核 + MaxScore 剪枝）
+
+        改写 Query 通常只有 1-3 条，合并为 (查询数 × 文档数) 稀疏累加实测并不更快，且会绕过剪枝
+
+        返回:
+            与 queries 对齐的 [[(doc_id, bm25_score), ...], ...]
+        """
+        return [self.search(query, topk) for query in queries]
+
+    def _top_k(self, scores: np.ndarray, topk: int) -> list[tuple[str, float]]:
+        """Top-K：argpartition 选出候选后仅对 K 个结果排序"""
+        candidates = np.flatnonzero(scores)
+        if topk < len(candidates):
+            candidates = candidates[np.argpartition(-scores[candidates], topk)[:topk]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.doc_ids[i], float(scores[i])) for i in candidates]
 
     def save(self, filepath: str):
-        """保存索引到文件"""
+        """
+        保存索引到文件
+
+        扩展名为 .npz 时以列式格式保存（CSR 数组 + JSON 元数据，加载无需 pickle）；
+        否则以 pickle 保存（安装 zstandard 时以 zstd 流压缩）
+        """
+        if str(filepath).endswith('.npz'):
+            self._save_npz(filepath)
+            print(f"倒排索引已保存: {filepath}")
+            return
         with open(filepath, 'wb') as f:
-            pickle.dump({
-                'index': self.index,
-                'doc_lengths': self.doc_lengths,
-                'avg_doc_length': self.avg_doc_length,
-                'num_docs': self.num_docs,
-                'documents': self.documents,
-                'k1': self.k1,
-                'b': self.b,
-                'stopwords': self.stopwords
-            }, f)
+            if zstandard is not None:
+                with zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(f) as z:
+                    self._dump(z)
+            else:
+                self._dump(f)
         print(f"倒排索引已保存: {filepath}")
 
-    def load(self, filepath: str):
-        """从文件加载索引"""
+    def _dump(self, f):
+        """以最高 pickle 协议写出索引状态（协议 5 对 NumPy 数组直接写缓冲区）"""
+        pickle.dump({
+            'terms': list(self.vocab),
+            'term_offsets': self.term_offsets,
+            'posting_doc_idxs': self.posting_doc_idxs,
+            'posting_tfs': self.posting_tfs,
+            'idf': self.idf,
+            'doc_ids': self.doc_ids,
+            'doc_lengths': self.doc_lengths,
+            'avg_doc_length': self.avg_doc_length,
+            'num_docs': self.num_docs,
+            'documents': self.documents,
+            'k1': self.k1,
+            'b': self.b,
+            'stopwords': self.stopwords
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _save_npz(self, filepath: str):
+        """列式格式：CSR 数组逐列连续存储（zip deflate 压缩），词表、文档等非数值状态编码为 JSON 字节列"""
+        meta = json.dumps({
+            'terms': list(self.vocab),
+            'doc_ids': self.doc_ids,
+            'avg_doc_length': self.avg_doc_length,
+            'num_docs': self.num_docs,
+            'documents': self.documents,
+            'k1': self.k1,
+            'b': self.b,
+            'stopwords': sorted(self.stopwords)
+        }, ensure_ascii=False).encode('utf-8')
+        np.savez_compressed(
+            filepath,
+            term_offsets=self.term_offsets,
+            posting_doc_idxs=self.posting_doc_idxs,
+            posting_tfs=self.posting_tfs,
+            idf=self.idf,
+            doc_lengths=self.doc_lengths,
+            meta=np.frombuffer(meta, dtype=np.uint8)
+        )
+
+    def _load_npz(self, f, keep_documents: bool = True):
+        """加载列式格式（allow_pickle=False：文件中只有数值数组）"""
+        with np.load(f, allow_pickle=False) as data:
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            self.avg_doc_length = meta['avg_doc_length']
+            self.num_docs = meta['num_docs']
+            self.documents = meta['documents'] if keep_documents else {}
+            self.k1 = meta['k1']
+            self.b = meta['b']
+            self.stopwords = frozenset(meta['stopwords'])
+            self.doc_ids = meta['doc_ids']
+            self.doc_lengths = data['doc_lengths']
+            self._set_csr(meta['terms'], data['term_offsets'], data['posting_doc_idxs'],
+                          data['posting_tfs'], data['idf'])
+
+    def load(self, filepath: str, keep_documents: bool = True):
+        """
+        从文件加载索引
+
+        支持 .npz 列式格式与 pickle 格式（兼容旧版 {term: {doc_id: tf}} 与按词项分列的 {term: (doc_idxs, tfs)} 格式）；
+        keep_documents 为 False 时加载后丢弃原文，只保留检索所需的倒排数组
+        """
         with open(filepath, 'rb') as f:
-            data = pickle.load(f)
-            self.index = data['index']
+            magic = f.read(4)
+            if magic == _ZIP_MAGIC:
+                f.seek(0)
+                self._load_npz(f, keep_documents)
+                print("倒排索引已加载")
+                return
+            if magic == _ZSTD_MAGIC:
+                if zstandard is None:
+                    raise ImportError("索引文件为 zstd 压缩格式，请先安装 zstandard")
+                f.seek(0)
+                with zstandard.ZstdDecompressor().stream_reader(f) as z:
+                    data = pickle.load(z)
+            else:
+                f.seek(0)
+                data = pickle.load(f)
+        self.avg_doc_length = data['avg_doc_length']
+        self.num_docs = data['num_docs']
+        self.documents = data['documents'] if keep_documents else {}
+        self.k1 = data['k1']
+        self.b = data['b']
+        self.stopwords = frozenset(data.get('stopwords', ()))
+
+        if 'term_offsets' in data:
+            self.doc_ids = data['doc_ids']
+            self.doc_lengths = data['doc_lengths']
+            self._set_csr(data['terms'], data['term_offsets'], data['posting_doc_idxs'],
+                          data['posting_tfs'], data['idf'])
+            print("倒排索引已加载")
+            return
+
+        if 'doc_ids' in data:
+            self.doc_ids = data['doc_ids']
             self.doc_lengths = data['doc_lengths']
-            self.avg_doc_length = data['avg_doc_length']
-            self.num_docs = data['num_docs']
-            self.documents = data['documents']
-            self.k1 = data['k1']
-            self.b = data['b']
-            self.stopwords = data.get('stopwords', set())
+            postings = data['index']
+        else:
+            # 旧版格式：doc_lengths 为 {doc_id: length}，index 为 {term: {doc_id: tf}}
+            self.doc_ids = list(data['doc_lengths'])
+            self.doc_lengths = np.asarray(list(data['doc_lengths'].values()), dtype=np.float32)
+            doc_idx_of = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+            postings = {
+                term: ([doc_idx_of[doc_id] for doc_id in posting], list(posting.values()))
+                for term, posting in data['index'].items()
+            }
+        self._set_postings(postings, data.get('idf'))
         print(f"倒排索引已加载")
@@ -1,9 +1,30 @@
 """意图处理模块：识别、检测、扩展、HyDE 生成"""
 
+import re
 import json
 import time
+import threading
+from collections import OrderedDict
 from dashscope import Generation
 
+from modules.clients import HTTP_SESSION
+
+# orjson 解析速度更快，未安装时回退标准库
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# 明确时效性关键词（与意图检测提示词中 clear 的判断标准一致）
+_CLEAR_TIME_PATTERN = re.compile(r'最近|最新|现在|今年|当前')
+
+_TIME_SENSITIVITIES = frozenset(('clear', 'implied'))
+
+# LLM 输出解析/结构错误（JSON 解码错误均为 ValueError 子类）：重新采样即可，立即重试；
+# 其余异常（调用失败、网络、限流）退避后重试
+_PARSE_ERRORS = (ValueError, KeyError, TypeError)
+
 
 class IntentRecognizer:
     """意图识别器：判断问题是否需要检索知识库"""
@@ -31,7 +52,8 @@ class IntentRecognizer:
             api_key=self.api_key,
             model=self.model,
             messages=messages,
-            result_format="message"
+            result_format="message",
+            session=HTTP_SESSION
         )
 
         if response.status_code == 200:
@@ -48,6 +70,48 @@ class IntentDetector:
         self.llm_client = llm_client
         self.exact_room_types = exact_room_types
         self.fuzzy_room_types = fuzzy_room_types
+        # 校验 LLM 输出用的集合（列表保留原顺序用于提示词）
+        self._exact_set = frozenset(exact_room_types)
+        self._fuzzy_set = frozenset(fuzzy_room_types)
+        # 房型列表固定不变，提示词中的 JSON 文本只序列化一次
+        self._exact_room_types_json = json.dumps(exact_room_types, ensure_ascii=False)
+        self._fuzzy_room_types_json = json.dumps(fuzzy_room_types, ensure_ascii=False)
+        # 房型字面匹配：长名称优先，避免被其子串截断
+        self._exact_pattern = self._literal_pattern(exact_room_types)
+        self._fuzzy_pattern = self._literal_pattern(fuzzy_room_types)
+        # 房型名称的双字片段（花园、城央、羊羊、双床……），用于发现匹配房型之外的其他房型表述
+        self._fragment_pattern = self._literal_pattern({
+            word[i:i + 2] for word in exact_room_types + fuzzy_room_types for i in range(len(word) - 1)
+        })
+
+    @staticmethod
+    def _literal_pattern(words):
+        return re.compile('|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True)))
+
+    def _detect_by_rules(self, query: str) -> dict | None:
+        """
+        规则快速路径：查询字面包含唯一房型、其余部分不含任何房型片段且含明确时效性关键词时，结果确定，无需调用 LLM
+
+        多个房型（如对比）、房型名称被拆开书写（如"城央绿意的大床房"）或残缺（如"羊羊主题套房"）时
+        需按提示词规则判断，返回 None 交由 LLM 处理；隐含时效性（implied）同样只能由 LLM 判断
+        """
+        if not _CLEAR_TIME_PATTERN.search(query):
+            return None
+        exact = set(self._exact_pattern.findall(query))
+        if len(exact) > 1:
+            return None
+        if exact:
+            name = exact.pop()
+            result = {"room_type": name, "fuzzy_room_type": None, "time_sensitivity": "clear"}
+        else:
+            fuzzy = set(self._fuzzy_pattern.findall(query))
+            if len(fuzzy) != 1:
+                return None
+            name = fuzzy.pop()
+            result = {"room_type": None, "fuzzy_room_type": name, "time_sensitivity": "clear"}
+        if self._fragment_pattern.search(query.replace(name, '')):
+            return None
+        return result
 
     def detect(self, query: str) -> dict:
         """
@@ -60,6 +124,10 @@ class IntentDetector:
                 "time_sensitivity": "clear" | "implied" | None
             }
         """
+        result = self._detect_by_rules(query)
+        if result is not None:
+            return result
+
         prompt = f"""
 你是一个酒店智能客服助手，需要分析用户查询并提取关键信息。
 
@@ -69,10 +137,10 @@ class IntentDetector:
 2. 时效性需求：用户是否关注最新信息
 
 【精确房型列表】
-{json.dumps(self.exact_room_types, ensure_ascii=False)}
+{self._exact_room_types_json}
 
 【模糊房型列表】
-{json.dumps(self.fuzzy_room_types, ensure_ascii=False)}
+{self._fuzzy_room_types_json}
 
 【房型检测规则】
 - 优先检测精确房型，如检测到则填入 room_type，若模棱两可或只能检测到模糊房型则视为未检测到，填入 None。填入的内容只能是【精确房型列表】中的房型名称或 None
@@ -100,19 +168,18 @@ class IntentDetector:
             try:
                 response = self.llm_client.generate(prompt, temperature=0.1)
                 response = response.replace('```json', '').replace('```', '').strip()
-                data = json.loads(response)
-                if data['room_type'] and data['room_type'] not in self.exact_room_types:
+                data = _json_loads(response)
+                if data['room_type'] and data['room_type'] not in self._exact_set:
                     data['room_type'] = None
-                if data['fuzzy_room_type'] and data['fuzzy_room_type'] not in self.fuzzy_room_types:
+                if data['fuzzy_room_type'] and data['fuzzy_room_type'] not in self._fuzzy_set:
                     data['fuzzy_room_type'] = None
-                if data['time_sensitivity'] and data['time_sensitivity'] not in ['clear', 'implied']:
+                if data['time_sensitivity'] and data['time_sensitivity'] not in _TIME_SENSITIVITIES:
                     data['time_sensitivity'] = None
                 return data
             except Exception as e:
                 print(f"意图检测第 {i+1} 次尝试失败: {e}")
-                if i < 1:
+                if i < 1 and not isinstance(e, _PARSE_ERRORS):
                     time.sleep(0.1)
-                    continue
 
         print("意图检测失败，已返回全 None 字典")
         return {
@@ -175,7 +242,7 @@ class IntentExpander:
             try:
                 response = self.llm_client.generate(prompt, temperature=0.3)
                 response = response.replace('```json', '').replace('```', '').strip()
-                data = json.loads(response)
+                data = _json_loads(response)
                 queries = data['rewritten_queries']
                 if isinstance(queries, list):
                     for item in queries:
@@ -186,9 +253,8 @@ class IntentExpander:
                     raise TypeError(f"queries 数据类型错误: 期望 list, 实际为 {type(queries).__name__}")
             except Exception as e:
                 print(f"意图扩展第 {i+1} 次尝试失败: {e}")
-                if i < 1:
+                if i < 1 and not isinstance(e, _PARSE_ERRORS):
                     time.sleep(0.1)
-                    continue
 
         print("意图扩展失败，已返回 None")
         return None
@@ -197,12 +263,43 @@ class IntentExpander:
 class HyDEGenerator:
     """假设性回复生成器：为单个 Query 生成假设回复用于增强检索"""
 
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, cache_size: int = 1024):
         self.llm_client = llm_client
+        # 生成结果 LRU 缓存：{query: 假设回复元组}，生成失败的兜底结果不缓存
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
 
     def generate(self, query: str) -> list[str]:
+        """为单个查询生成假设性回复（优先读缓存）"""
+        return self.generate_cached(query)[0]
+
+    def generate_cached(self, query: str) -> tuple[list[str], bool]:
+        """为单个查询生成假设性回复，返回 (假设回复, 是否命中缓存)"""
+        if self.cache_size > 0:
+            with self._cache_lock:
+                cached = self._cache.get(query)
+                if cached is not None:
+                    self._cache.move_to_end(query)
+                    return list(cached), True
+
+        responses = self._generate(query)
+        if self.cache_size > 0 and responses is not None:
+            with self._cache_lock:
+                self._cache[query] = tuple(responses)
+                self._cache.move_to_end(query)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return responses if responses is not None else [query], False
+
+    def clear_cache(self):
+        """清空生成结果缓存"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _generate(self, query: str):
         """
-        为单个查询生成假设性回复
+        调用 LLM 生成假设性回复，失败返回 None
 
         策略：生成2条正面回复 + 1条负面回复
         """
@@ -238,7 +335,7 @@ class HyDEGenerator:
             try:
                 response = self.llm_client.generate(prompt, temperature=0.7)
                 response = response.replace('```json', '').replace('```', '').strip()
-                data = json.loads(response)
+                data = _json_loads(response)
                 responses = data['hypothetical_responses']
                 if isinstance(responses, list):
                     return responses
@@ -246,9 +343,8 @@ class HyDEGenerator:
                     raise TypeError(f"responses 数据类型错误: 期望 list, 实际为 {type(responses).__name__}")
             except Exception as e:
                 print(f"假设性回复生成第 {i+1} 次尝试失败: {e}")
-                if i < 1:
+                if i < 1 and not isinstance(e, _PARSE_ERRORS):
                     time.sleep(0.1)
-                    continue
 
         print("假设性回复生成失败，已返回原查询")
-        return [query]
+        return None
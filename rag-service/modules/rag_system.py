@@ -1,24 +1,35 @@
 """酒店评论 RAG 系统：完整的检索增强生成工作流"""
 
 import time
+import queue
+import threading
 from pathlib import Path
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import pandas as pd
 import dashvector
 import chromadb
 
 from config import TODAY, EXACT_ROOM_TYPES, FUZZY_ROOM_TYPES
-from modules.clients import LLMClient, EmbeddingClient
+from modules.clients import HTTP_POOL_SIZE, LLMClient, EmbeddingClient
 from modules.index import InvertedIndex
 from modules.intent import IntentRecognizer, IntentDetector, IntentExpander, HyDEGenerator
 from modules.retriever import HybridRetriever
-from modules.ranker import Reranker, MultiFactorRanker
+from modules.ranker import Reranker, MultiFactorRanker, CorpusFeatures
 from modules.generator import ResponseGenerator
+from modules.answer_cache import SemanticAnswerCache
 from utils.database import get_all_comments_from_insforge
 
 
+# 返回结果中每条评论保留的字段（启用排序时追加排序字段）
+_RESULT_FIELDS = ('comment_id', 'comment', 'rrf_score', 'rrf_rank', 'route_ranks', 'metadata')
+_RESULT_RANKING_FIELDS = _RESULT_FIELDS + ('rerank_score', 'rerank_rank', 'final_score', 'final_rank', 'feature_scores')
+_STREAM_FIELDS = ('comment_id', 'comment', 'metadata')
+_STREAM_RANKING_FIELDS = _STREAM_FIELDS + ('final_rank', 'final_score')
+
+
 class HotelReviewRAG:
     """酒店评论 RAG 系统：完整的检索增强生成工作流"""
 
@@ -27,7 +38,8 @@ class HotelReviewRAG:
                  intl_api_key: str = None,
                  detection_model: str = "qwen-plus",
                  expansion_hyde_model: str = "qwen-flash",
-                 generation_model: str = "qwen-plus"):
+                 generation_model: str = "qwen-plus",
+                 speculative_intent: bool = True):
         """
         初始化 RAG 系统
 
@@ -41,6 +53,8 @@ class HotelReviewRAG:
             detection_model: 意图检测模型
             expansion_hyde_model: 意图扩展/HyDE 模型
             generation_model: 回复生成模型
+            speculative_intent: 是否在意图识别完成前预先提交意图检测/扩展（需检索的查询省去一次串行 LLM 往返，
+                闲聊类查询则多付两次用不上的 LLM 调用）；意图识别命中缓存时总是按识别结果提交
         """
         # 连接向量数据库
         dashvector_client = dashvector.Client(
@@ -55,7 +69,8 @@ class HotelReviewRAG:
 
         # 加载倒排索引
         self.inverted_index = InvertedIndex()
-        self.inverted_index.load(str(data_dir / "inverted_index.pkl"))
+        # 评论原文由 df_comments 提供，索引只保留倒排数组
+        self.inverted_index.load(str(data_dir / "inverted_index.pkl"), keep_documents=False)
 
         # 加载评论数据
         if df_comments is not None:
@@ -83,13 +98,27 @@ class HotelReviewRAG:
             embedding_client, self.df_comments, self.hyde_generator
         )
         self.reranker = Reranker(key)
+        self.corpus_features = CorpusFeatures(self.df_comments)
+        self.ranker = MultiFactorRanker(self.reranker, corpus=self.corpus_features)
         self.generator = ResponseGenerator(key, model=generation_model)
+        # 语义回答缓存：由 API 层在流式问答时查找/写入
+        self.answer_cache = SemanticAnswerCache(embedding_client)
+        # 查询处理线程池：意图检测/扩展与意图识别并发执行，长驻复用（同时限制并发 LLM 调用数）
+        self._intent_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='intent')
+        # 意图识别/检测/扩展结果的 LRU 缓存：{(任务, 查询): 结果}，重复查询跳过对应的 LLM 调用
+        self.intent_cache_size = 1024
+        self.speculative_intent = speculative_intent
+        self._intent_cache = OrderedDict()
+        self._intent_cache_lock = threading.Lock()
+        # 流式生成预取线程池：生成请求先于参考评论发出，评论格式化与模型首字延迟重叠（每路流式生成占用一个线程）
+        self._generation_pool = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix='generation')
 
     def query(self, user_query: str,
               route_topk: int = 150,
               retrieval_topk: int = 100,
               ranking_topk: int = 10,
               enable_expansion: bool = True,
+              expansion_min_length: int = 0,
               enable_bm25: bool = True,
               enable_vector: bool = True,
               enable_reverse: bool = True,
@@ -121,48 +150,30 @@ class HotelReviewRAG:
                 'timing': { ... }
             }
         """
-        total_start = time.time()
+        total_start = time.monotonic()
         timing = {}
         if not today:
             today = datetime.today()
 
         # 一、查询处理
-        query_processing_start = time.time()
+        query_processing_start = time.monotonic()
 
-        # 1. 意图识别
-        intent_recognition_start = time.time()
-        need_retrieval = self.intent_recognizer.recognize(user_query)
-        timing['intent_recognition'] = time.time() - intent_recognition_start
+        # 1. 意图识别（意图检测与意图扩展不依赖识别结果，可预先提交与之并发执行）
+        need_retrieval, future_detect, future_expand = self._recognize_intent(
+            user_query, self._should_expand(user_query, enable_expansion, expansion_min_length), timing
+        )
 
         # 2. 意图检测与意图扩展
-        intent_detection_result = None
-        intent_expansion_result = None
-        timing['intent_detection'] = 0
-        timing['intent_expansion'] = 0
-
-        if need_retrieval:
-            if enable_expansion:
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    future_detect = executor.submit(
-                        self._timed_call, self.intent_detector.detect, user_query
-                    )
-                    future_expand = executor.submit(
-                        self._timed_call, self.intent_expander.expand, user_query
-                    )
-                    intent_detection_result, timing['intent_detection'] = future_detect.result()
-                    intent_expansion_result, timing['intent_expansion'] = future_expand.result()
-            else:
-                intent_detection_result, timing['intent_detection'] = self._timed_call(
-                    self.intent_detector.detect, user_query
-                )
-                intent_expansion_result, timing['intent_expansion'] = None, 0
+        intent_detection_result, intent_expansion_result = self._collect_intent_tasks(
+            future_detect, future_expand, need_retrieval, timing
+        )
 
-        timing['query_processing_total'] = time.time() - query_processing_start
+        timing['query_processing_total'] = time.monotonic() - query_processing_start
 
         # 直接回答
         if not need_retrieval:
             if enable_generation:
-                first_token_base = time.time() - total_start
+                first_token_base = time.monotonic() - total_start
                 response, ttft_model, subsequent, generation = self.generator.generate(
                     user_query, need_retrieval=False, print_response=print_response,
                     today=today, history=history
@@ -178,7 +189,7 @@ class HotelReviewRAG:
                 timing['subsequent'] = 0
                 timing['generation'] = 0
 
-            timing['total'] = time.time() - total_start
+            timing['total'] = time.monotonic() - total_start
             return {
                 'response': response,
                 'references': {'comments': [], 'summaries': [], 'hyde_responses': {}},
@@ -216,8 +227,7 @@ class HotelReviewRAG:
 
         # 三、排序
         if enable_ranking:
-            ranker = MultiFactorRanker(
-                self.reranker,
+            ranker = self.ranker.configure(
                 w_relevance=w_relevance, w_quality=w_quality,
                 w_length=w_length, w_review=w_review,
                 w_useful=w_useful, w_recency=w_recency,
@@ -236,7 +246,7 @@ class HotelReviewRAG:
 
         # 四、回复生成
         if enable_generation:
-            first_token_base = time.time() - total_start
+            first_token_base = time.monotonic() - total_start
             response, ttft_model, subsequent, generation = self.generator.generate(
                 user_query,
                 rewritten_queries=intent_expansion_result,
@@ -258,26 +268,11 @@ class HotelReviewRAG:
             timing['subsequent'] = 0
             timing['generation'] = 0
 
-        timing['total'] = time.time() - total_start
+        timing['total'] = time.monotonic() - total_start
 
         # 五、构建返回结果
-        processed_comments = []
-        for c in ranked_comments:
-            comment_data = {
-                'comment_id': c['comment_id'],
-                'comment': c['comment'],
-                'rrf_score': c['rrf_score'],
-                'rrf_rank': c['rrf_rank'],
-                'route_ranks': c['route_ranks'],
-                'metadata': c['metadata']
-            }
-            if enable_ranking:
-                comment_data['rerank_score'] = c['rerank_score']
-                comment_data['rerank_rank'] = c['rerank_rank']
-                comment_data['final_score'] = c['final_score']
-                comment_data['final_rank'] = c['final_rank']
-                comment_data['feature_scores'] = c['feature_scores']
-            processed_comments.append(comment_data)
+        fields = _RESULT_RANKING_FIELDS if enable_ranking else _RESULT_FIELDS
+        processed_comments = [{k: c[k] for k in fields} for c in ranked_comments]
 
         return {
             'response': response,
@@ -299,6 +294,7 @@ class HotelReviewRAG:
                      retrieval_topk: int = 100,
                      ranking_topk: int = 10,
                      enable_expansion: bool = True,
+                     expansion_min_length: int = 0,
                      enable_bm25: bool = True,
                      enable_vector: bool = True,
                      enable_reverse: bool = True,
@@ -323,43 +319,34 @@ class HotelReviewRAG:
         Yields:
             dict: SSE 事件，格式为 {"type": ..., "data": ...} 或 {"type": "chunk", "content": ...}
         """
-        total_start = time.time()
+        total_start = time.monotonic()
         timing = {}
         if not today:
             today = datetime.today()
 
+        # 进入即发送阶段事件，前端在意图识别（LLM 往返）期间即可显示"思考中"
+        yield {"type": "status", "data": {"phase": "recognizing"}}
+        timing['ttft_sse'] = time.monotonic() - total_start
+
         # 一、查询处理
-        query_processing_start = time.time()
+        query_processing_start = time.monotonic()
 
-        intent_recognition_start = time.time()
-        need_retrieval = self.intent_recognizer.recognize(user_query)
-        timing['intent_recognition'] = time.time() - intent_recognition_start
+        # 意图识别（意图检测与意图扩展可预先提交，与之并发执行）
+        need_retrieval, future_detect, future_expand = self._recognize_intent(
+            user_query, self._should_expand(user_query, enable_expansion, expansion_min_length), timing
+        )
 
         # 发送意图识别结果（前端据此控制"检索中"显示）
         yield {"type": "intent", "data": {"need_retrieval": need_retrieval}}
 
-        intent_detection_result = None
-        intent_expansion_result = None
-        timing['intent_detection'] = 0
-        timing['intent_expansion'] = 0
-
         if need_retrieval:
-            if enable_expansion:
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    future_detect = executor.submit(
-                        self._timed_call, self.intent_detector.detect, user_query
-                    )
-                    future_expand = executor.submit(
-                        self._timed_call, self.intent_expander.expand, user_query
-                    )
-                    intent_detection_result, timing['intent_detection'] = future_detect.result()
-                    intent_expansion_result, timing['intent_expansion'] = future_expand.result()
-            else:
-                intent_detection_result, timing['intent_detection'] = self._timed_call(
-                    self.intent_detector.detect, user_query
-                )
+            yield {"type": "status", "data": {"phase": "detecting"}}
+
+        intent_detection_result, intent_expansion_result = self._collect_intent_tasks(
+            future_detect, future_expand, need_retrieval, timing
+        )
 
-        timing['query_processing_total'] = time.time() - query_processing_start
+        timing['query_processing_total'] = time.monotonic() - query_processing_start
 
         # 直接回答（不需要检索）
         if not need_retrieval:
@@ -368,7 +355,7 @@ class HotelReviewRAG:
             ):
                 yield {"type": "chunk", "content": chunk}
 
-            timing['total'] = time.time() - total_start
+            timing['total'] = time.monotonic() - total_start
             yield {
                 "type": "done",
                 "data": {
@@ -388,6 +375,7 @@ class HotelReviewRAG:
                              if intent_expansion_result
                              else [{'query': user_query, 'weight': 1.0}])
 
+        yield {"type": "status", "data": {"phase": "retrieving"}}
         comments, summaries, retrieval_timing, hyde_results = self.retriever.retrieve(
             rewritten_queries,
             room_type=intent_detection_result.get('room_type'),
@@ -404,8 +392,7 @@ class HotelReviewRAG:
 
         # 三、排序
         if enable_ranking:
-            ranker = MultiFactorRanker(
-                self.reranker,
+            ranker = self.ranker.configure(
                 w_relevance=w_relevance, w_quality=w_quality,
                 w_length=w_length, w_review=w_review,
                 w_useful=w_useful, w_recency=w_recency,
@@ -422,32 +409,8 @@ class HotelReviewRAG:
             ranked_comments = comments
             timing['ranking'] = {'total': 0, 'rerank': 0, 'scoring': 0}
 
-        # 发送参考评论（在生成之前）
-        processed_comments = []
-        for c in ranked_comments:
-            comment_data = {
-                'comment_id': c['comment_id'],
-                'comment': c['comment'],
-                'metadata': c['metadata']
-            }
-            if enable_ranking:
-                comment_data['final_rank'] = c['final_rank']
-                comment_data['final_score'] = c['final_score']
-            processed_comments.append(comment_data)
-
-        yield {
-            "type": "references",
-            "data": {
-                "comments": processed_comments,
-                "summaries": [
-                    {"summary": s['summary'], "metadata": s['metadata']}
-                    for s in summaries
-                ]
-            }
-        }
-
-        # 四、流式回复生成
-        for chunk in self.generator.generate_stream(
+        # 四、流式回复生成：先于参考评论发出生成请求，评论的格式化/发送与模型首字延迟并行
+        chunks, stop_generation = self._prefetch_stream(self.generator.generate_stream(
             user_query,
             rewritten_queries=intent_expansion_result,
             ranked_comments=ranked_comments,
@@ -455,17 +418,194 @@ class HotelReviewRAG:
             need_retrieval=True,
             today=today,
             history=history
-        ):
-            yield {"type": "chunk", "content": chunk}
+        ))
+
+        # 客户端在任一 yield 处断开（含尚未开始消费 chunks 的参考评论处）都通知生成端停止
+        try:
+            # 发送参考评论（在生成文本之前）
+            fields = _STREAM_RANKING_FIELDS if enable_ranking else _STREAM_FIELDS
+            processed_comments = [{k: c[k] for k in fields} for c in ranked_comments]
 
-        timing['total'] = time.time() - total_start
+            yield {
+                "type": "references",
+                "data": {
+                    "comments": processed_comments,
+                    "summaries": [
+                        {"summary": s['summary'], "metadata": s['metadata']}
+                        for s in summaries
+                    ]
+                }
+            }
+
+            for chunk in chunks:
+                yield {"type": "chunk", "content": chunk}
+        finally:
+            stop_generation()
+
+        timing['total'] = time.monotonic() - total_start
         yield {
             "type": "done",
             "data": {"timing": timing}
         }
 
+    def _prefetch_stream(self, stream) -> tuple:
+        """
+        在生成线程池中提前消费流式生成器，返回 (按序产出其元素的生成器, 停止函数)
+
+        异常在消费端重新抛出；调用停止函数（如客户端断开）后生产端不再拉取后续元素并关闭原生成器。
+        消费端生成器尚未开始迭代时关闭它不会执行其 finally，因此停止函数需由调用方显式调用
+        """
+        buffer = queue.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def pump():
+            try:
+                for item in stream:
+                    if stopped.is_set():
+                        break
+                    buffer.put(item)
+            except Exception as e:
+                buffer.put(e)
+            finally:
+                if hasattr(stream, 'close'):
+                    stream.close()
+                buffer.put(done)
+
+        self._generation_pool.submit(pump)
+
+        def consume():
+            try:
+                while (item := buffer.get()) is not done:
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                stopped.set()
+
+        return consume(), stopped.set
+
+    @staticmethod
+    def _should_expand(user_query: str, enable_expansion: bool, min_length: int) -> bool:
+        """
+        是否执行意图扩展：expansion_min_length > 0 时，短于该长度的查询跳过扩展（省去扩展的 LLM 往返），
+        直接以原查询检索；默认 0 表示总是扩展
+        """
+        return enable_expansion and len(user_query.strip()) >= min_length
+
+    def _recognize_intent(self, user_query: str, enable_expansion: bool, timing: dict) -> tuple:
+        """
+        意图识别，并提交意图检测与（可选的）意图扩展任务，返回 (need_retrieval, future_detect, future_expand)
+
+        speculative_intent 开启且识别结果未缓存时，检测/扩展先于识别提交；否则识别确认需要检索后才提交，
+        无需检索时两个 Future 均为 None
+        """
+        speculate = self.speculative_intent and not self._has_cached_intent('recognize', user_query)
+        future_detect, future_expand = (
+            self._submit_intent_tasks(user_query, enable_expansion) if speculate else (None, None)
+        )
+
+        intent_recognition_start = time.monotonic()
+        need_retrieval, timing['intent_recognition_cached'] = self._cached_intent(
+            'recognize', self.intent_recognizer.recognize, user_query
+        )
+        timing['intent_recognition'] = time.monotonic() - intent_recognition_start
+
+        if need_retrieval:
+            if not speculate:
+                future_detect, future_expand = self._submit_intent_tasks(user_query, enable_expansion)
+            self._prefetch_query_embeddings(user_query, future_detect, future_expand)
+        return need_retrieval, future_detect, future_expand
+
+    def _submit_intent_tasks(self, user_query: str, enable_expansion: bool) -> tuple:
+        """提交意图检测与（可选的）意图扩展任务（命中缓存时直接返回已完成的 Future）"""
+        future_detect = self._submit_cached_intent('detect', self.intent_detector.detect, user_query)
+        future_expand = None
+        if enable_expansion:
+            future_expand = self._submit_cached_intent('expand', self.intent_expander.expand, user_query)
+        return future_detect, future_expand
+
+    def _prefetch_query_embeddings(self, user_query: str, future_detect, future_expand):
+        """
+        意图识别确认需要检索后，若检索 Query 已确定（未启用扩展，或扩展已完成）预先请求其 embedding，
+        与尚未完成的意图检测并发；结果写入 EmbeddingClient 缓存，检索时直接命中。
+        意图检测已完成时检索紧随其后，不再预取以免重复请求
+        """
+        if future_detect.done():
+            return
+        if future_expand is None:
+            queries = [user_query]
+        elif future_expand.done() and future_expand.exception() is None and future_expand.result()[0]:
+            queries = [item['query'] for item in future_expand.result()[0]]
+        else:
+            return
+        self._intent_pool.submit(self.retriever.embedding_client.embed_batch, queries)
+
+    def _submit_cached_intent(self, task: str, func, user_query: str) -> Future:
+        """命中缓存时返回以 (结果, 0) 完成的 Future，否则提交到线程池计时执行"""
+        key = (task, user_query.strip())
+        with self._intent_cache_lock:
+            if key in self._intent_cache:
+                self._intent_cache.move_to_end(key)
+                future = Future()
+                future.set_result((self._intent_cache[key], 0))
+                return future
+        return self._intent_pool.submit(self._timed_call, self._cached_intent_result, task, func, user_query)
+
+    def _has_cached_intent(self, task: str, user_query: str) -> bool:
+        """意图任务结果是否已缓存（不更新 LRU 顺序）"""
+        with self._intent_cache_lock:
+            return (task, user_query.strip()) in self._intent_cache
+
+    def _cached_intent(self, task: str, func, user_query: str) -> tuple:
+        """带缓存的意图任务调用，返回 (结果, 是否命中缓存)"""
+        key = (task, user_query.strip())
+        with self._intent_cache_lock:
+            if key in self._intent_cache:
+                self._intent_cache.move_to_end(key)
+                return self._intent_cache[key], True
+        return self._cached_intent_result(task, func, user_query), False
+
+    def _cached_intent_result(self, task: str, func, user_query: str):
+        """调用意图任务并写入缓存（扩展失败返回的 None 不缓存，下次重新请求）"""
+        result = func(user_query)
+        if result is not None:
+            key = (task, user_query.strip())
+            with self._intent_cache_lock:
+                self._intent_cache[key] = result
+                self._intent_cache.move_to_end(key)
+                while len(self._intent_cache) > self.intent_cache_size:
+                    self._intent_cache.popitem(last=False)
+        return result
+
+    def clear_intent_cache(self):
+        """清空意图结果缓存（更换模型或提示词后调用）"""
+        with self._intent_cache_lock:
+            self._intent_cache.clear()
+
+    def _collect_intent_tasks(self, future_detect, future_expand, need_retrieval: bool, timing: dict) -> tuple:
+        """
+        收集意图检测与扩展结果，计时写入 timing
+
+        无需检索时丢弃预先提交的任务（尚未开始的直接取消），返回 (None, None)
+        """
+        timing['intent_detection'] = 0
+        timing['intent_expansion'] = 0
+
+        if not need_retrieval:
+            for future in (future_detect, future_expand):
+                if future is not None:
+                    future.cancel()
+            return None, None
+
+        intent_detection_result, timing['intent_detection'] = future_detect.result()
+        intent_expansion_result = None
+        if future_expand is not None:
+            intent_expansion_result, timing['intent_expansion'] = future_expand.result()
+        return intent_detection_result, intent_expansion_result
+
     def _timed_call(self, func, *args) -> tuple:
         """带计时的函数调用"""
-        start = time.time()
+        start = time.monotonic()
         result = func(*args)
-        return result, time.time() - start
+        return result, time.monotonic() - start
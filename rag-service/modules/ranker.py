@@ -1,18 +1,33 @@
 """排序模块：Reranker + 线性加权"""
 
+import copy
+import math
 import time
 import numpy as np
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dashscope import TextReRank
 
+from modules.clients import HTTP_SESSION
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 
 class Reranker:
     """Reranker：使用 Qwen3-Rerank 模型计算相关性得分"""
 
-    def __init__(self, api_key: str, model: str = "qwen3-rerank"):
+    def __init__(self, api_key: str, model: str = "qwen3-rerank", chunk_size: int = 500):
         self.api_key = api_key
         self.model = model
+        # 相关性得分按 (query, document) 独立计算：文档超过 chunk_size 时分片并发请求。
+        # 默认取接口单次请求的文档数上限（500），默认的 retrieval_topk=100 只需一次请求，
+        # 分片只用于超出上限的候选集，避免多一次计费与往返
+        self.chunk_size = chunk_size
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rerank')
 
     def rerank(self, query: str, documents: list[str], topk: int = None) -> dict:
         """
@@ -23,22 +38,115 @@ class Reranker:
         """
         if topk is None:
             topk = len(documents)
-
+        if len(documents) <= self.chunk_size:
+            return self._rerank(query, documents, topk, 0)
+
+        offsets = range(0, len(documents), self.chunk_size)
+        futures = [
+            self._pool.submit(self._rerank, query, documents[offset:offset + self.chunk_size], topk, offset)
+            for offset in offsets[1:]
+        ]
+        scores = self._rerank(query, documents[:self.chunk_size], topk, 0)
+        for future in futures:
+            scores.update(future.result())
+        if topk < len(scores):
+            scores = dict(sorted(scores.items(), key=lambda x: x[1], reverse=True)[:topk])
+        return scores
+
+    def _rerank(self, query: str, documents: list[str], topk: int, offset: int) -> dict:
+        """单次 Rerank 请求，返回以 offset 平移后的全局下标"""
         response = TextReRank.call(
             api_key=self.api_key,
             model=self.model,
             query=query,
             documents=documents,
-            top_n=topk,
-            return_documents=False
+            top_n=min(topk, len(documents)),
+            return_documents=False,
+            session=HTTP_SESSION
         )
 
         if response.status_code == 200:
-            return {item.index: item.relevance_score for item in response.output.results}
+            return {offset + item.index: item.relevance_score for item in response.output.results}
         else:
             raise RuntimeError(f"Rerank 调用失败: {response.message}")
 
 
+_NS_PER_DAY = 86_400_000_000_000
+
+
+def _to_ns(dates) -> np.ndarray:
+    """日期序列 -> int64 纳秒时间戳"""
+    return np.asarray(dates, dtype='datetime64[ns]').view(np.int64)
+
+
+def _score_features(quality_score, comment_len, review_count, useful_count, days_ago,
+                    recency_scale, weights, features):
+    """
+    单趟融合内核：逐候选计算归一化特征并写入 features[1:6]，返回加权综合得分
+
+    features[0] 为已填入的相关性得分
+    """
+    n = features.shape[1]
+    final_score = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        quality = quality_score[i] / 10.0
+        length = math.log1p(comment_len[i]) / 7.51
+        review = math.log1p(review_count[i]) / 6.32
+        useful = math.log1p(useful_count[i]) / 3.64
+        recency = math.exp(days_ago[i] * recency_scale)
+        features[1, i] = quality
+        features[2, i] = length
+        features[3, i] = review
+        features[4, i] = useful
+        features[5, i] = recency
+        final_score[i] = (weights[0] * features[0, i] + weights[1] * quality + weights[2] * length
+                          + weights[3] * review + weights[4] * useful + weights[5] * recency)
+    return final_score
+
+
+# 安装 numba 时编译为融合标量循环，省去中间数组；否则走 NumPy 逐特征向量化路径
+if njit is not None:
+    _score_features = njit(cache=True, fastmath=True)(_score_features)
+
+
+def _normalize_features(quality_score, comment_len, review_count, useful_count, out):
+    """与查询无关的四个特征归一化，写入 out 的四行"""
+    norm_quality, norm_length, norm_review, norm_useful = out
+
+    np.divide(quality_score, 10.0, out=norm_quality)
+
+    np.log1p(comment_len, out=norm_length)
+    norm_length /= 7.51
+
+    np.log1p(review_count, out=norm_review)
+    norm_review /= 6.32
+
+    np.log1p(useful_count, out=norm_useful)
+    norm_useful /= 3.64
+
+
+class CorpusFeatures:
+    """评论语料的列式（SoA）特征：按 comment_id 成批取用排序所需字段"""
+
+    def __init__(self, df_comments: pd.DataFrame):
+        self.positions = {comment_id: pos for pos, comment_id in enumerate(df_comments.index)}
+        # 质量/长度/回复数/有用数只取决于语料，加载时一次性归一化为 (4, N) float32 矩阵，查询时按列取用
+        self.normalized = np.empty((4, len(df_comments)), dtype=np.float32)
+        _normalize_features(
+            df_comments['quality_score'].to_numpy(dtype=np.float32),
+            df_comments['comment'].str.len().to_numpy(dtype=np.float32),
+            df_comments['review_count'].to_numpy(dtype=np.float32),
+            df_comments['useful_count'].to_numpy(dtype=np.float32),
+            self.normalized
+        )
+        # 发布时间预解析为 int64 纳秒时间戳，排序时只做整数运算
+        self.publish_ns = _to_ns(pd.to_datetime(df_comments['publish_date']))
+
+    def take(self, comment_ids: list) -> np.ndarray:
+        """comment_id 列表 -> 语料行号数组"""
+        return np.fromiter((self.positions[c] for c in comment_ids), dtype=np.int64, count=len(comment_ids))
+
+
 class MultiFactorRanker:
     """多因子排序器：融合相关性、内容质量、时效性进行综合排序"""
 
@@ -52,8 +160,10 @@ class MultiFactorRanker:
                  base_decay: float = 0.5,
                  implied_boost: float = 0.5,
                  clear_boost: float = 0.5,
-                 half_life_days: int = 180):
+                 half_life_days: int = 180,
+                 corpus: CorpusFeatures = None):
         self.reranker = reranker
+        self.corpus = corpus
 
         self.w_relevance = w_relevance
         self.w_quality = w_quality
@@ -67,6 +177,21 @@ class MultiFactorRanker:
         self.clear_boost = clear_boost
         self.half_life_days = half_life_days
 
+    def configure(self, **params) -> 'MultiFactorRanker':
+        """
+        按给定权重/衰减参数取得排序器
+
+        参数与当前一致时直接复用自身；否则返回修改了参数的浅拷贝，
+        不改动共享实例，并发查询互不影响
+        """
+        changed = {k: v for k, v in params.items() if getattr(self, k) != v}
+        if not changed:
+            return self
+        ranker = copy.copy(self)
+        for k, v in changed.items():
+            setattr(ranker, k, v)
+        return ranker
+
     def rank(self, query: str, candidates: list[dict], time_sensitivity: str = None,
              topk: int = 10, today: datetime | None = None) -> tuple[list[dict], dict]:
         """
@@ -75,36 +200,47 @@ class MultiFactorRanker:
         返回:
             (ranked_results, timing_info)
         """
-        ranking_start = time.time()
+        ranking_start = time.monotonic()
 
         if not candidates:
             return [], {'total': 0, 'rerank': 0, 'scoring': 0}
 
         # 1. Rerank 打分
-        rerank_start = time.time()
-        documents = [c['comment'] for c in candidates]
+        rerank_start = time.monotonic()
+        # 检索返回的列式候选直接取评论列与行号，逐条字典只为最终 Top-K 物化
+        positions = getattr(candidates, 'positions', None)
+        if positions is not None:
+            documents = candidates.comments
+        else:
+            documents = [c['comment'] for c in candidates]
         relevance_map = self.reranker.rerank(query, documents)
-        rerank_time = time.time() - rerank_start
+        rerank_time = time.monotonic() - rerank_start
 
         # 2. 提取各特征值
-        scoring_start = time.time()
-
-        relevance_score = np.array([relevance_map.get(i, 0) for i in range(len(candidates))])
-
-        quality_score = np.array([c['metadata']['quality_score'] for c in candidates])
-        norm_quality = quality_score / 10.0
-
-        comment_len = np.array([len(c['comment']) for c in candidates])
-        log_comment_len = np.log(comment_len + 1)
-        norm_length = log_comment_len / 7.51
-
-        review_count = np.array([c['metadata']['review_count'] for c in candidates])
-        log_review_count = np.log(review_count + 1)
-        norm_review = log_review_count / 6.32
-
-        useful_count = np.array([c['metadata']['useful_count'] for c in candidates])
-        log_useful_count = np.log(useful_count + 1)
-        norm_useful = log_useful_count / 3.64
+        scoring_start = time.monotonic()
+
+        # 六个特征写入同一块 (6, N) float32 缓冲区，按行原地计算，最后一次矩阵-向量乘得到综合得分；
+        # 得分只用于排序比较，单精度足够且减半内存带宽
+        features = np.empty((6, len(candidates)), dtype=np.float32)
+        relevance_score, recency_score = features[0], features[5]
+
+        relevance_score[:] = [relevance_map.get(i, 0) for i in range(len(candidates))]
+
+        # 有语料列式特征时按行号直接取用预归一化特征，否则从候选字典逐条提取
+        if self.corpus is not None:
+            if positions is not None:
+                # 检索器与 CorpusFeatures 基于同一 df_comments，行号可直接对应
+                rows = positions
+            else:
+                rows = self.corpus.take([c['comment_id'] for c in candidates])
+            np.take(self.corpus.normalized, rows, axis=1, out=features[1:5])
+            publish_ns = self.corpus.publish_ns[rows]
+        else:
+            quality_score = np.array([c['metadata']['quality_score'] for c in candidates], dtype=np.float32)
+            comment_len = np.array([len(c['comment']) for c in candidates], dtype=np.float32)
+            review_count = np.array([c['metadata']['review_count'] for c in candidates], dtype=np.float32)
+            useful_count = np.array([c['metadata']['useful_count'] for c in candidates], dtype=np.float32)
+            publish_ns = _to_ns(pd.to_datetime([c['metadata']['publish_date'] for c in candidates]))
 
         # 时效性
         decay = self.base_decay
@@ -113,54 +249,72 @@ class MultiFactorRanker:
         elif time_sensitivity == "clear":
             decay += self.implied_boost + self.clear_boost
 
-        publish_date = pd.to_datetime([c['metadata']['publish_date'] for c in candidates])
         if not today:
             today = datetime.today()
-        days_ago = (today - publish_date).days.values
-        days_ago = np.maximum(days_ago, 0)
-        recency_score = np.exp(-decay * days_ago / self.half_life_days)
+        # 整数纳秒差按天向下取整，与 Timedelta.days 一致
+        today_ns = np.datetime64(today, 'ns').view(np.int64)
+        days_ago = np.maximum((today_ns - publish_ns) // _NS_PER_DAY, 0)
+        recency_scale = -decay / self.half_life_days
 
         # 3. 计算综合得分
-        final_score = (
-            self.w_relevance * relevance_score +
-            self.w_quality * norm_quality +
-            self.w_length * norm_length +
-            self.w_review * norm_review +
-            self.w_useful * norm_useful +
-            self.w_recency * recency_score
-        )
-        sorted_index = np.argsort(final_score)[::-1]
+        weights = np.array([self.w_relevance, self.w_quality, self.w_length,
+                            self.w_review, self.w_useful, self.w_recency], dtype=np.float32)
+        if self.corpus is None and njit is not None:
+            final_score = _score_features(
+                quality_score, comment_len, review_count, useful_count, days_ago, recency_scale, weights, features
+            )
+        else:
+            if self.corpus is None:
+                _normalize_features(quality_score, comment_len, review_count, useful_count, features[1:5])
+            np.multiply(days_ago, recency_scale, out=recency_score)
+            np.exp(recency_score, out=recency_score)
+
+            final_score = weights @ features
+
+        # Top-K：argpartition 选出前 topk 名后仅对这部分排序
+        if topk < len(final_score):
+            top_index = np.argpartition(-final_score, topk)[:topk]
+        else:
+            top_index = np.arange(len(final_score))
+        sorted_index = top_index[np.argsort(-final_score[top_index], kind='stable')]
 
         # 4. 构建结果
         ranked_results = []
 
-        rerank_sorted_index = np.argsort(relevance_score)[::-1]
-        rerank_rank = np.empty_like(rerank_sorted_index)
-        rerank_rank[rerank_sorted_index] = np.arange(1, len(relevance_score) + 1)
+        # 只为输出的 Top-K 计算 Rerank 名次：得分更高者数 + 同分中下标更大者数（与逆序排序一致）
+        selected = relevance_score[sorted_index]
+        higher = relevance_score[:, None] > selected
+        tied_after = (relevance_score[:, None] == selected) & (np.arange(len(relevance_score))[:, None] > sorted_index)
+        rerank_rank = 1 + higher.sum(axis=0) + tied_after.sum(axis=0)
+
+        # Top-K 特征与得分一次性转为 Python 数值
+        top_features = features[:, sorted_index].T.tolist()
+        top_scores = final_score[sorted_index].tolist()
 
-        for rank, idx in enumerate(sorted_index[:topk], 1):
+        for rank, (idx, rerank_pos, score, feature_row) in enumerate(
+                zip(sorted_index.tolist(), rerank_rank.tolist(), top_scores, top_features), 1):
+            relevance, quality, length, review, useful, recency = feature_row
+            # 列式候选每次访问都物化出新字典，可直接原地补充字段；调用方传入的字典则先浅拷贝
             c = candidates[idx]
-            result = {
-                **c,
-                'rerank_score': float(relevance_score[idx]),
-                'rerank_rank': int(rerank_rank[idx]),
-                'final_score': float(final_score[idx]),
-                'final_rank': rank,
-                'feature_scores': {
-                    'relevance': float(relevance_score[idx]),
-                    'quality': float(norm_quality[idx]),
-                    'log_comment_len': float(norm_length[idx]),
-                    'log_review_count': float(norm_review[idx]),
-                    'log_useful_count': float(norm_useful[idx]),
-                    'recency': float(recency_score[idx])
-                }
+            result = c if positions is not None else c.copy()
+            result['rerank_score'] = relevance
+            result['rerank_rank'] = rerank_pos
+            result['final_score'] = score
+            result['final_rank'] = rank
+            result['feature_scores'] = {
+                'relevance': relevance,
+                'quality': quality,
+                'log_comment_len': length,
+                'log_review_count': review,
+                'log_useful_count': useful,
+                'recency': recency
             }
             ranked_results.append(result)
 
-        scoring_time = time.time() - scoring_start
+        scoring_time = time.monotonic() - scoring_start
 
         timing_info = {
-            'total': time.time() - ranking_start,
+            'total': time.monotonic() - ranking_start,
             'rerank': rerank_time,
             'scoring': scoring_time
         }
@@ -1,15 +1,93 @@
 """混合检索器：多路召回 + RRF 融合"""
 
 import time
-from collections import defaultdict
+import threading
+import numpy as np
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
+class RetrievalCandidates:
+    """
+    检索候选的列式表示：按 RRF 排名给出 df_comments 行号与得分，
+    逐条结果字典仅在访问时物化（排序阶段只需物化最终 Top-K）
+    """
+
+    def __init__(self, doc_ids, columns, positions, rrf_scores, route_results):
+        self.positions = positions
+        self.rrf_scores = rrf_scores
+        self._doc_ids = doc_ids
+        self._columns = columns
+        self._route_results = route_results
+        self._route_ranks = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('RetrievalCandidates index out of range')
+        return self._materialize(i)
+
+    @property
+    def comment_ids(self) -> list:
+        return [self._doc_ids[pos] for pos in self.positions.tolist()]
+
+    @property
+    def comments(self) -> list[str]:
+        return [self._columns['comment'][pos] for pos in self.positions.tolist()]
+
+    def _get_route_ranks(self) -> dict:
+        """首次物化时单趟扫描各路命中，按行号归组各路排名"""
+        if self._route_ranks is None:
+            route_ranks = {pos: {} for pos in self.positions.tolist()}
+            doc_pos = {doc_id: pos for doc_id, pos in zip(self.comment_ids, route_ranks)}
+            for route_name, results in self._route_results.items():
+                for doc_id, _, rank, metadata in results:
+                    pos = doc_pos.get(doc_id)
+                    if pos is not None:
+                        route_ranks[pos].setdefault(route_name, []).append({
+                            'rank': rank,
+                            'metadata': metadata
+                        })
+            self._route_ranks = route_ranks
+        return self._route_ranks
+
+    def _materialize(self, i) -> dict:
+        pos = int(self.positions[i])
+        columns = self._columns
+        return {
+            'comment_id': self._doc_ids[pos],
+            'comment': columns['comment'][pos],
+            'rrf_score': float(self.rrf_scores[i]),
+            'rrf_rank': i + 1,
+            'route_ranks': self._get_route_ranks()[pos],
+            'metadata': {
+                'score': columns['score'][pos],
+                'publish_date': columns['publish_date'][pos],
+                'quality_score': columns['quality_score'][pos],
+                'review_count': columns['review_count'][pos],
+                'useful_count': columns['useful_count'][pos],
+                'room_type': columns['room_type'][pos],
+                'fuzzy_room_type': columns['fuzzy_room_type'][pos]
+            }
+        }
+
+
 class HybridRetriever:
     """混合检索器：多路召回 + RRF 融合"""
 
     def __init__(self, inverted_index, comments_collection, reverse_queries_collection,
-                 summaries_collection, embedding_client, df_comments, hyde_generator):
+                 summaries_collection, embedding_client, df_comments, hyde_generator,
+                 cache_size=512, cache_ttl=120, clock=time.monotonic):
         self.inverted_index = inverted_index
         self.comments_collection = comments_collection
         self.reverse_queries_collection = reverse_queries_collection
@@ -17,12 +95,41 @@ class HybridRetriever:
         self.embedding_client = embedding_client
         self.hyde_generator = hyde_generator
         self.df_comments = df_comments
+        # 评论紧凑编号：df_comments 行号，RRF 融合在该编号空间上做稠密累加
+        self._doc_ids = list(df_comments.index)
+        self._doc_pos = {doc_id: pos for pos, doc_id in enumerate(self._doc_ids)}
+        # 构建检索结果所需的列按紧凑编号预取为列表，避免逐条 df.loc 查询
+        self._columns = {
+            col: df_comments[col].tolist()
+            for col in ('comment', 'score', 'publish_date', 'quality_score',
+                        'review_count', 'useful_count', 'room_type', 'fuzzy_room_type')
+        }
+        # 长驻线程池：路由级任务会阻塞等待子任务，叶子任务（单次检索/模型调用）不再等待其他任务，
+        # 两级分池避免嵌套等待造成线程饥饿死锁
+        self._route_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='retriever-route')
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='retriever-task')
+        # 检索结果 LRU 缓存：{key: (写入时间, (comment_results, summary_results, hyde_results))}
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._clock = clock      # 缓存计时用的单调时钟，可注入以便测试
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def close(self):
+        """关闭检索线程池"""
+        self._route_pool.shutdown(wait=True)
+        self._pool.shutdown(wait=True)
+
+    def clear_cache(self):
+        """清空检索结果缓存"""
+        with self._cache_lock:
+            self._cache.clear()
 
     def retrieve(self, rewritten_queries, room_type=None, fuzzy_room_type=None, topk=150,
                  final_topk=100, enable_bm25=True, enable_vector=True,
                  enable_reverse=True, enable_hyde=True, enable_summary=True):
         """
-        混合检索
+        混合检索（相同 Query、过滤条件与开关组合在 TTL 内直接返回缓存结果）
 
         参数:
             rewritten_queries: 改写后的 Query 列表及权重
@@ -32,18 +139,53 @@ class HybridRetriever:
             final_topk: 最终返回的评论数量
 
         返回:
-            (comment_results, summary_results, timing_info, hyde_results)
+            (comment_results, summary_results, timing_info, hyde_results)，
+            comment_results 为 RetrievalCandidates，可按序列方式取用逐条结果字典
         """
+        start = time.monotonic()
+        key = (
+            tuple((item['query'], item['weight']) for item in rewritten_queries),
+            room_type, fuzzy_room_type, topk, final_topk,
+            enable_bm25, enable_vector, enable_reverse, enable_hyde, enable_summary,
+            self.inverted_index.version
+        )
+
+        if self.cache_size > 0:
+            with self._cache_lock:
+                entry = self._cache.get(key)
+                if entry is not None and self._clock() - entry[0] <= self.cache_ttl:
+                    self._cache.move_to_end(key)
+                    comment_results, summary_results, hyde_results = entry[1]
+                    timing = {
+                        'bm25': 0, 'vector': 0, 'reverse': 0,
+                        'hyde': {'total': 0, 'generation': 0, 'retrieval': 0, 'cache_hits': 0},
+                        'summary': 0, 'rrf_fusion': 0
+                    }
+                    timing_info = {'routes': timing, 'total': time.monotonic() - start, 'cache_hit': True}
+                    return comment_results, list(summary_results), timing_info, dict(hyde_results)
+
+        comment_results, summary_results, timing_info, hyde_results = self._retrieve(
+            rewritten_queries, room_type, fuzzy_room_type, topk, final_topk,
+            enable_bm25, enable_vector, enable_reverse, enable_hyde, enable_summary
+        )
+
+        if self.cache_size > 0:
+            with self._cache_lock:
+                self._cache[key] = (self._clock(), (comment_results, list(summary_results), dict(hyde_results)))
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return comment_results, summary_results, timing_info, hyde_results
+
+    def _retrieve(self, rewritten_queries, room_type, fuzzy_room_type, topk, final_topk,
+                  enable_bm25, enable_vector, enable_reverse, enable_hyde, enable_summary):
+        """执行多路召回与 RRF 融合"""
         timing = {}
-        retrieve_start_time = time.time()
+        retrieve_start_time = time.monotonic()
 
         queries = [item['query'] for item in rewritten_queries]
         weights = [item['weight'] for item in rewritten_queries]
-        embedding_time = 0
-        if sum([enable_vector, enable_reverse, enable_summary]):
-            embedding_start_time = time.time()
-            query_embeddings = self.embedding_client.embed_batch(queries)
-            embedding_time = time.time() - embedding_start_time
 
         # 构建房型过滤条件
         room_filter = None
@@ -56,44 +198,49 @@ class HybridRetriever:
         if enabled_routes == 0:
             raise ValueError("至少需要启用一路召回")
 
-        with ThreadPoolExecutor(max_workers=enabled_routes) as executor:
-            futures = {}
-            if enable_bm25:
-                futures[executor.submit(self._route_bm25, queries, topk)] = 'bm25'
-            if enable_vector:
-                futures[executor.submit(self._route_vector, query_embeddings, topk, room_filter)] = 'vector'
-            if enable_reverse:
-                futures[executor.submit(self._route_reverse, query_embeddings, topk, room_filter)] = 'reverse'
-            if enable_hyde:
-                futures[executor.submit(self._route_hyde, queries, topk, room_filter)] = 'hyde'
-            if enable_summary:
-                futures[executor.submit(self._route_summary, query_embeddings)] = 'summary'
-
-            comment_results = []
-            summary_results = []
-            route_results = {}
-            hyde_results = {}
-
-            for future in as_completed(futures):
-                route_name = futures[future]
-
-                if route_name == 'summary':
-                    results, route_timing = future.result()
-                    timing[route_name] = route_timing + embedding_time
-                    summary_results = results
-
-                elif route_name == 'hyde':
-                    results, route_timing, hyde_generated = future.result()
-                    timing[route_name] = route_timing
-                    route_results[route_name] = results
-                    comment_results.extend(results)
-                    hyde_results = hyde_generated
-
-                else:
-                    results, route_timing = future.result()
-                    timing[route_name] = route_timing if route_name == 'bm25' else route_timing + embedding_time
-                    route_results[route_name] = results
-                    comment_results.extend(results)
+        # BM25 与 HyDE 不依赖 Query 向量，先行提交，与 Query 向量化并行
+        executor = self._route_pool
+        futures = {}
+        if enable_bm25:
+            futures[executor.submit(self._route_bm25, queries, topk)] = 'bm25'
+        if enable_hyde:
+            futures[executor.submit(self._route_hyde, queries, topk, room_filter)] = 'hyde'
+
+        embedding_time = 0
+        if sum([enable_vector, enable_reverse, enable_summary]):
+            embedding_start_time = time.monotonic()
+            query_embeddings = self.embedding_client.embed_batch(queries)
+            embedding_time = time.monotonic() - embedding_start_time
+
+        if enable_vector:
+            futures[executor.submit(self._route_vector, query_embeddings, topk, room_filter)] = 'vector'
+        if enable_reverse:
+            futures[executor.submit(self._route_reverse, query_embeddings, topk, room_filter)] = 'reverse'
+        if enable_summary:
+            futures[executor.submit(self._route_summary, query_embeddings)] = 'summary'
+
+        summary_results = []
+        route_results = {}
+        hyde_results = {}
+
+        for future in as_completed(futures):
+            route_name = futures[future]
+
+            if route_name == 'summary':
+                results, route_timing = future.result()
+                timing[route_name] = route_timing + embedding_time
+                summary_results = results
+
+            elif route_name == 'hyde':
+                results, route_timing, hyde_generated = future.result()
+                timing[route_name] = route_timing
+                route_results[route_name] = results
+                hyde_results = hyde_generated
+
+            else:
+                results, route_timing = future.result()
+                timing[route_name] = route_timing if route_name == 'bm25' else route_timing + embedding_time
+                route_results[route_name] = results
 
         # 设置未启用通路的默认延迟
         if not enable_bm25:
@@ -103,54 +250,29 @@ class HybridRetriever:
         if not enable_reverse:
             timing['reverse'] = 0
         if not enable_hyde:
-            timing['hyde'] = {'total': 0, 'generation': 0, 'retrieval': 0}
+            timing['hyde'] = {'total': 0, 'generation': 0, 'retrieval': 0, 'cache_hits': 0}
         if not enable_summary:
             timing['summary'] = 0
 
         # RRF 融合
-        rrf_start_time = time.time()
-        rrf_scores = self._rrf_fusion(comment_results, weights, k=60)
-
-        rrf_sorted = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-        rrf_ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(rrf_sorted, 1)}
-
-        # 构建检索结果
-        final_comment_results = []
-        for doc_id, rrf_score in rrf_sorted[:final_topk]:
-            comment_row = self.df_comments.loc[doc_id]
-
-            route_ranks = {}
-            for route_name, results in route_results.items():
-                for d_id, r_name, rank, metadata in results:
-                    if d_id == doc_id:
-                        if route_name not in route_ranks:
-                            route_ranks[route_name] = []
-                        route_ranks[route_name].append({
-                            'rank': rank,
-                            'metadata': metadata
-                        })
-
-            final_comment_results.append({
-                'comment_id': doc_id,
-                'comment': comment_row['comment'],
-                'rrf_score': rrf_score,
-                'rrf_rank': rrf_ranks[doc_id],
-                'route_ranks': route_ranks,
-                'metadata': {
-                    'score': comment_row['score'],
-                    'publish_date': comment_row['publish_date'],
-                    'quality_score': comment_row['quality_score'],
-                    'review_count': comment_row['review_count'],
-                    'useful_count': comment_row['useful_count'],
-                    'room_type': comment_row['room_type'],
-                    'fuzzy_room_type': comment_row['fuzzy_room_type']
-                }
-            })
+        rrf_start_time = time.monotonic()
+        rrf_scores = self._rrf_fusion(route_results, weights, k=60)
+
+        # Top-K：argpartition 选出候选后仅对 final_topk 个结果排序（同分按紧凑编号）
+        candidates = np.flatnonzero(rrf_scores)
+        if final_topk < len(candidates):
+            candidates = np.sort(candidates[np.argpartition(-rrf_scores[candidates], final_topk)[:final_topk]])
+        candidates = candidates[np.argsort(-rrf_scores[candidates], kind='stable')]
+
+        # 列式候选：只保存行号与得分，结果字典由下游按需物化
+        final_comment_results = RetrievalCandidates(
+            self._doc_ids, self._columns, candidates, rrf_scores[candidates], route_results
+        )
 
-        timing['rrf_fusion'] = time.time() - rrf_start_time
+        timing['rrf_fusion'] = time.monotonic() - rrf_start_time
         timing_info = {
             'routes': timing,
-            'total': time.time() - retrieve_start_time
+            'total': time.monotonic() - retrieve_start_time
         }
 
         return final_comment_results, summary_results, timing_info, hyde_results
@@ -159,36 +281,26 @@ class HybridRetriever:
 
     def _route_bm25(self, queries, topk):
         """第一路：BM25 文本召回"""
-        start = time.time()
-        results = []
-        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
-            futures = [
-                executor.submit(self._single_bm25_query, query_idx, query, topk)
-                for query_idx, query in enumerate(queries)
-            ]
-            for future in as_completed(futures):
-                results.extend(future.result())
-        return results, time.time() - start
-
-    def _single_bm25_query(self, query_idx, query, topk):
-        bm25_results = self.inverted_index.search(query, topk=topk)
-        return [(doc_id, 'bm25', rank, {'query_idx': query_idx})
-                for rank, (doc_id, score) in enumerate(bm25_results, 1)]
+        start = time.monotonic()
+        batch_results = self.inverted_index.search_batch(queries, topk=topk)
+        results = [(doc_id, 'bm25', rank, {'query_idx': query_idx})
+                   for query_idx, bm25_results in enumerate(batch_results)
+                   for rank, (doc_id, score) in enumerate(bm25_results, 1)]
+        return results, time.monotonic() - start
 
     # ── 向量路 ────────────────────────────────────────────────
 
     def _route_vector(self, query_embeddings, topk, room_filter):
         """第二路：基础向量召回"""
-        start = time.time()
+        start = time.monotonic()
         results = []
-        with ThreadPoolExecutor(max_workers=len(query_embeddings)) as executor:
-            futures = [
-                executor.submit(self._single_vector_query, query_idx, emb, room_filter, topk)
-                for query_idx, emb in enumerate(query_embeddings)
-            ]
-            for future in as_completed(futures):
-                results.extend(future.result())
-        return results, time.time() - start
+        futures = [
+            self._pool.submit(self._single_vector_query, query_idx, emb, room_filter, topk)
+            for query_idx, emb in enumerate(query_embeddings)
+        ]
+        for future in as_completed(futures):
+            results.extend(future.result())
+        return results, time.monotonic() - start
 
     def _single_vector_query(self, query_idx, embedding, room_filter, topk):
         response = self.comments_collection.query(vector=embedding, topk=topk, filter=room_filter)
@@ -200,81 +312,88 @@ class HybridRetriever:
 
     def _route_reverse(self, query_embeddings, topk, room_filter):
         """第三路：反向 Query 召回"""
-        start = time.time()
+        start = time.monotonic()
         results = []
-        with ThreadPoolExecutor(max_workers=len(query_embeddings)) as executor:
-            futures = [
-                executor.submit(self._single_reverse_query, query_idx, emb, room_filter, topk)
-                for query_idx, emb in enumerate(query_embeddings)
-            ]
-            for future in as_completed(futures):
-                results.extend(future.result())
-        return results, time.time() - start
+        futures = [
+            self._pool.submit(self._single_reverse_query, query_idx, emb, room_filter, topk)
+            for query_idx, emb in enumerate(query_embeddings)
+        ]
+        for future in as_completed(futures):
+            results.extend(future.result())
+        return results, time.monotonic() - start
 
     def _single_reverse_query(self, query_idx, embedding, room_filter, topk):
         response = self.reverse_queries_collection.query(vector=embedding, topk=topk, filter=room_filter)
         docs = response.output if response.output else []
-        return [(doc.fields.get('comment_id'), 'reverse', rank, {'query_idx': query_idx})
-                for rank, doc in enumerate(docs, 1)]
+        # 缺少 comment_id 字段的反向 Query 无法对应评论，跳过（保留其余命中的原始排名）
+        return [(comment_id, 'reverse', rank, {'query_idx': query_idx})
+                for rank, doc in enumerate(docs, 1)
+                if (comment_id := doc.fields.get('comment_id')) is not None]
 
     # ── HyDE 路 ──────────────────────────────────────────────
 
     def _route_hyde(self, queries, topk, room_filter):
         """第四路：HyDE 增强召回"""
-        route_start = time.time()
-        results = []
+        route_start = time.monotonic()
         hyde_generated = {}
         generation_time = []
-        retrieval_time = []
-
-        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
-            futures = [
-                executor.submit(self._single_hyde_pipeline, query_idx, query, topk, room_filter)
-                for query_idx, query in enumerate(queries)
-            ]
-            for future in as_completed(futures):
-                query_results, gen_time, ret_time, query_idx, hyde_responses = future.result()
-                results.extend(query_results)
-                generation_time.append(gen_time)
-                retrieval_time.append(ret_time)
-                hyde_generated[query_idx] = hyde_responses
+        cache_hits = 0
+
+        # 各 Query 的假设回复并行生成
+        futures = {
+            self._pool.submit(self._single_hyde_generation, query): query_idx
+            for query_idx, query in enumerate(queries)
+        }
+        for future in as_completed(futures):
+            hyde_responses, gen_time, cached = future.result()
+            hyde_generated[futures[future]] = hyde_responses
+            generation_time.append(gen_time)
+            cache_hits += cached
+
+        # 全部假设回复合并为一次向量化请求，再按 (query_idx, hyde_idx) 拆回
+        ret_start = time.monotonic()
+        all_hyde = [(query_idx, hyde_idx, text)
+                    for query_idx in sorted(hyde_generated)
+                    for hyde_idx, text in enumerate(hyde_generated[query_idx])]
+        hyde_embeddings = self.embedding_client.embed_batch([text for _, _, text in all_hyde]) if all_hyde else []
+
+        futures = [
+            self._pool.submit(self._single_hyde_query, query_idx, hyde_idx, emb, room_filter, topk)
+            for (query_idx, hyde_idx, _), emb in zip(all_hyde, hyde_embeddings)
+        ]
+
+        raw_results = []
+        for future in as_completed(futures):
+            raw_results.extend(future.result())
+
+        # 去重：同一 Query 下保留最优排名。以 (query_idx, 紧凑编号) 为键、排名为次键排序，
+        # 每组首条即最优结果（同排名时保留先出现者）；df_comments 中没有的文档 ID 跳过
+        doc_pos = self._doc_pos
+        raw_results = [hit for hit in raw_results if hit[0] in doc_pos]
+        results = []
+        if raw_results:
+            num_docs = len(self._doc_ids)
+            keys = np.fromiter((metadata['query_idx'] * num_docs + doc_pos[doc_id]
+                                for doc_id, _, _, metadata in raw_results), dtype=np.int64, count=len(raw_results))
+            ranks = np.fromiter((rank for _, _, rank, _ in raw_results), dtype=np.int64, count=len(raw_results))
+            order = np.lexsort((ranks, keys))
+            sorted_keys = keys[order]
+            group_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            results = [raw_results[i] for i in order[group_starts]]
 
         timing = {
-            'total': time.time() - route_start,
+            'total': time.monotonic() - route_start,
             'generation': max(generation_time),
-            'retrieval': max(retrieval_time)
+            'retrieval': time.monotonic() - ret_start,
+            'cache_hits': cache_hits
         }
         return results, timing, hyde_generated
 
-    def _single_hyde_pipeline(self, query_idx, query, topk, room_filter):
-        """单个 Query 的 HyDE 生成与召回"""
-        gen_start = time.time()
-        hyde_responses = self.hyde_generator.generate(query)
-        generation_time = time.time() - gen_start
-
-        ret_start = time.time()
-        hyde_embeddings = self.embedding_client.embed_batch(hyde_responses)
-
-        raw_results = []
-        with ThreadPoolExecutor(max_workers=len(hyde_embeddings)) as executor:
-            futures = [
-                executor.submit(self._single_hyde_query, query_idx, hyde_idx, emb, room_filter, topk)
-                for hyde_idx, emb in enumerate(hyde_embeddings)
-            ]
-            for future in as_completed(futures):
-                raw_results.extend(future.result())
-
-        # 去重
-        best_candidates = {}
-        for item in raw_results:
-            doc_id, route_name, rank, metadata = item
-            if doc_id not in best_candidates or rank < best_candidates[doc_id][0]:
-                best_candidates[doc_id] = (rank, item)
-
-        results = [item for rank, item in best_candidates.values()]
-        retrieval_time = time.time() - ret_start
-
-        return results, generation_time, retrieval_time, query_idx, hyde_responses
+    def _single_hyde_generation(self, query):
+        """单个 Query 的 HyDE 生成，返回 (假设回复, 耗时, 是否命中缓存)"""
+        gen_start = time.monotonic()
+        hyde_responses, cached = self.hyde_generator.generate_cached(query)
+        return hyde_responses, time.monotonic() - gen_start, cached
 
     def _single_hyde_query(self, query_idx, hyde_idx, embedding, room_filter, topk):
         response = self.comments_collection.query(vector=embedding, topk=topk, filter=room_filter)
@@ -286,36 +405,50 @@ class HybridRetriever:
 
     def _route_summary(self, query_embeddings):
         """第五路：类别摘要召回"""
-        start = time.time()
+        start = time.monotonic()
 
+        # 全部 Query 一次批量查询；距离未使用，不随结果返回
         summary_results = self.summaries_collection.query(
-            query_embeddings=query_embeddings, n_results=1
+            query_embeddings=query_embeddings, n_results=1, include=['documents', 'metadatas']
         )
 
-        category_map = {}
-        for query_idx, (category_ids, documents, metadatas) in enumerate(zip(
-            summary_results['ids'],
-            summary_results['documents'],
-            summary_results['metadatas']
-        )):
-            if category_ids:
-                category_id = category_ids[0]
-                if category_id not in category_map:
-                    category_map[category_id] = {
-                        'summary': documents[0],
-                        'metadata': metadatas[0] if metadatas else {},
-                        'retrieved_by_queries': []
-                    }
-                category_map[category_id]['retrieved_by_queries'].append(query_idx)
-
-        summaries = list(category_map.values())
-        return summaries, time.time() - start
+        # 按类别分组命中的 Query：np.unique 得到类别编号与首次出现位置，
+        # 稳定排序后按组切分 query_idx，类别按首次命中顺序输出
+        hit_queries = [query_idx for query_idx, category_ids in enumerate(summary_results['ids']) if category_ids]
+        if not hit_queries:
+            return [], time.monotonic() - start
+        query_idxs = np.array(hit_queries)
+        category_ids = np.array([summary_results['ids'][query_idx][0] for query_idx in hit_queries])
+        _, first_hits, inverse = np.unique(category_ids, return_index=True, return_inverse=True)
+        groups = np.split(query_idxs[np.argsort(inverse, kind='stable')], np.cumsum(np.bincount(inverse))[:-1])
+
+        summaries = []
+        for group_idx in np.argsort(first_hits):
+            query_idx = hit_queries[first_hits[group_idx]]
+            metadatas = summary_results['metadatas'][query_idx]
+            summaries.append({
+                'summary': summary_results['documents'][query_idx][0],
+                'metadata': metadatas[0] if metadatas else {},
+                'retrieved_by_queries': groups[group_idx].tolist()
+            })
+        return summaries, time.monotonic() - start
 
     # ── RRF 融合 ─────────────────────────────────────────────
 
-    def _rrf_fusion(self, all_results, weights, k=60):
-        """RRF 融合"""
-        rrf_scores = defaultdict(float)
-        for doc_id, route_name, rank, metadata in all_results:
-            rrf_scores[doc_id] += (1 / (k + rank)) * weights[metadata['query_idx']]
-        return dict(rrf_scores)
+    def _rrf_fusion(self, route_results, weights, k=60):
+        """
+        RRF 融合：全部命中展开为 (紧凑编号, 排名, query_idx) 平行数组，
+        贡献 weight / (k + rank) 经 bincount 按文档一次性累加；
+        向量库中存在而 df_comments 中没有的文档 ID 无法构建结果，直接跳过
+
+        返回:
+            与 df_comments 行号对齐的 RRF 得分数组
+        """
+        hits = [hit for results in route_results.values() for hit in results]
+        doc_pos = self._doc_pos
+        positions = np.fromiter((doc_pos.get(doc_id, -1) for doc_id, _, _, _ in hits), dtype=np.int64, count=len(hits))
+        ranks = np.fromiter((rank for _, _, rank, _ in hits), dtype=np.float64, count=len(hits))
+        query_idxs = np.fromiter((metadata['query_idx'] for _, _, _, metadata in hits), dtype=np.int64, count=len(hits))
+        known = positions >= 0
+        contributions = np.asarray(weights, dtype=np.float64)[query_idxs[known]] / (k + ranks[known])
+        return np.bincount(positions[known], weights=contributions, minlength=len(self._doc_ids))
@@ -109,8 +109,243 @@ def test_rag_system():
     return True
 
 
+def test_intent_rules():
+    """验证意图检测规则快速路径：仅唯一且完整的房型表述直接返回，其余交由 LLM"""
+    print("\n" + "=" * 50)
+    print("3. 测试意图检测规则快速路径")
+    print("=" * 50)
+
+    from config import EXACT_ROOM_TYPES, FUZZY_ROOM_TYPES
+    from modules.intent import IntentDetector
+
+    detector = IntentDetector(None, EXACT_ROOM_TYPES, FUZZY_ROOM_TYPES)
+
+    assert detector._detect_by_rules("最近花园大床房怎么样") == {
+        "room_type": "花园大床房", "fuzzy_room_type": None, "time_sensitivity": "clear"
+    }
+    assert detector._detect_by_rules("现在大床房的早餐怎么样") == {
+        "room_type": None, "fuzzy_room_type": "大床房", "time_sensitivity": "clear"
+    }
+    # 无明确时效性关键词：implied/None 只能由 LLM 判断
+    assert detector._detect_by_rules("花园大床房怎么样") is None
+    # 房型对比：按提示词规则属于模棱两可
+    assert detector._detect_by_rules("最近花园大床房和双床房哪个好") is None
+    # 精确房型被拆开书写：LLM 可识别为城央绿意大床房
+    assert detector._detect_by_rules("现在城央绿意的大床房隔音怎么样") is None
+    # 残缺的精确房型名称
+    assert detector._detect_by_rules("最新的羊羊主题套房怎么样") is None
+    print("  ✅ 规则快速路径判定正确")
+
+
+def _build_test_index(num_docs: int = 300):
+    """构造小型合成语料的倒排索引（固定随机种子，词表含高频与低频词）"""
+    import random
+    from modules.index import InvertedIndex
+
+    words = ["早餐", "服务", "位置", "房间", "隔音", "前台", "泳池", "花园", "交通", "停车",
+             "干净", "安静", "地铁", "价格", "景观"]
+    rng = random.Random(0)
+    documents = {
+        f"doc{i}": "，".join(rng.choices(words, weights=range(len(words), 0, -1), k=rng.randint(3, 20)))
+        for i in range(num_docs)
+    }
+    index = InvertedIndex()
+    index.build(documents, workers=1)
+    return index, documents
+
+
+def test_bm25_search():
+    """验证 BM25 检索：search（MaxScore 剪枝）与 search_batch 的 Top-K 得分与暴力计算一致"""
+    print("\n" + "=" * 50)
+    print("4. 测试 BM25 检索")
+    print("=" * 50)
+
+    import math
+    from collections import Counter
+
+    index, documents = _build_test_index()
+    doc_tokens = {doc_id: index.tokenize(text) for doc_id, text in documents.items()}
+    df = Counter(term for tokens in doc_tokens.values() for term in set(tokens))
+    avgdl = sum(map(len, doc_tokens.values())) / len(doc_tokens)
+
+    def brute_force(query, topk):
+        scores = []
+        for doc_id, tokens in doc_tokens.items():
+            tf = Counter(tokens)
+            norm = index.k1 * (1 - index.b + index.b * len(tokens) / avgdl)
+            score = sum(
+                math.log((len(doc_tokens) - df[t] + 0.5) / (df[t] + 0.5) + 1.0) * tf[t] * (index.k1 + 1) / (tf[t] + norm)
+                for t in index.tokenize(query) if tf[t]
+            )
+            if score > 0:
+                scores.append(score)
+        return sorted(scores, reverse=True)[:topk]
+
+    queries = ["早餐，服务，位置", "隔音，景观", "早餐，早餐，地铁，停车，价格", "不存在的词"]
+    for topk in (5, 50):
+        batch_results = index.search_batch(queries, topk=topk)
+        for query, batch in zip(queries, batch_results):
+            single = index.search(query, topk=topk)
+            assert batch == single
+            expected = brute_force(query, topk)
+            assert len(single) == len(expected)
+            assert all(math.isclose(score, ref, rel_tol=1e-4) for (_, score), ref in zip(single, expected))
+    print("  ✅ search / search_batch 与暴力计算一致")
+
+
+def test_answer_cache():
+    """验证语义回答缓存：相似度阈值、键一致（含意图识别结果）与 TTL 过期"""
+    print("\n" + "=" * 50)
+    print("5. 测试语义回答缓存")
+    print("=" * 50)
+
+    import numpy as np
+    from modules.answer_cache import SemanticAnswerCache
+
+    vectors = {"早餐怎么样": [1.0, 0.0], "早餐好吗": [0.96, 0.28], "停车方便吗": [0.6, 0.8]}
+
+    class FakeEmbedding:
+        def embed_batch(self, texts):
+            return [vectors[text] for text in texts]
+
+    now = [1000.0]
+    cache = SemanticAnswerCache(FakeEmbedding(), threshold=0.95, ttl=60, clock=lambda: now[0])
+    key = repr((True, []))
+    cache.put(cache.embed("早餐怎么样"), key, "answer")
+    assert np.isclose(np.linalg.norm(cache.embed("早餐好吗")), 1.0)
+
+    assert cache.get(cache.embed("早餐怎么样"), key) == "answer"
+    assert cache.get(cache.embed("早餐好吗"), key) == "answer"         # 余弦 0.96 ≥ 阈值
+    assert cache.get(cache.embed("停车方便吗"), key) is None            # 余弦 0.6 < 阈值
+    assert cache.get(cache.embed("早餐怎么样"), repr((False, []))) is None
+
+    now[0] += 60
+    assert cache.get(cache.embed("早餐怎么样"), key) == "answer"
+    now[0] += 1
+    assert cache.get(cache.embed("早餐怎么样"), key) is None
+    print("  ✅ 阈值 / 键 / TTL 判断正确")
+
+
+def test_retrieval_cache():
+    """验证检索结果缓存：键覆盖 Query/过滤条件/召回参数/索引版本，TTL 过期与 LRU 淘汰"""
+    print("\n" + "=" * 50)
+    print("6. 测试检索结果缓存")
+    print("=" * 50)
+
+    import pandas as pd
+    from modules.retriever import HybridRetriever
+
+    index, documents = _build_test_index()
+
+    class CountingIndex:
+        """记录 BM25 检索次数的倒排索引包装"""
+        def __init__(self, index):
+            self.index = index
+            self.calls = 0
+
+        @property
+        def version(self):
+            return self.index.version
+
+        def search_batch(self, queries, topk):
+            self.calls += 1
+            return self.index.search_batch(queries, topk=topk)
+
+    df_comments = pd.DataFrame({
+        'comment': list(documents.values()), 'score': 5, 'publish_date': '2024-01-01',
+        'quality_score': 1, 'review_count': 1, 'useful_count': 0,
+        'room_type': '大床房', 'fuzzy_room_type': '大床房'
+    }, index=list(documents))
+    counting_index = CountingIndex(index)
+    now = [1000.0]
+    retriever = HybridRetriever(
+        counting_index, None, None, None, None, df_comments, None,
+        cache_size=2, cache_ttl=120, clock=lambda: now[0]
+    )
+    bm25_only = {'enable_vector': False, 'enable_reverse': False, 'enable_hyde': False, 'enable_summary': False}
+
+    def retrieve(weight=1.0, **kwargs):
+        return retriever.retrieve([{'query': '早餐，服务', 'weight': weight}], **bm25_only, **kwargs)
+
+    try:
+        first = retrieve()
+        hit = retrieve()
+        assert len(first[0]) > 0 and counting_index.calls == 1
+        assert hit[0] is first[0] and hit[2]['cache_hit']
+
+        # 权重、过滤条件、召回数量不同均不命中
+        retrieve(weight=0.5)
+        retrieve(room_type='大床房')
+        retrieve(final_topk=10)
+        assert counting_index.calls == 4
+
+        # 容量 2：最早的条目已被淘汰
+        retrieve(weight=0.5)
+        assert counting_index.calls == 5
+
+        # 索引重建（版本递增）后不命中
+        retrieve(final_topk=10)
+        assert counting_index.calls == 5
+        index.build(documents, workers=1)
+        retrieve(final_topk=10)
+        assert counting_index.calls == 6
+
+        # TTL 过期后重新检索
+        now[0] += 120
+        assert retrieve(final_topk=10)[2]['cache_hit'] and counting_index.calls == 6
+        now[0] += 1
+        retrieve(final_topk=10)
+        assert counting_index.calls == 7
+    finally:
+        retriever.close()
+    print("  ✅ 缓存键 / TTL / LRU 判断正确")
+
+
+def test_index_npz_roundtrip():
+    """验证 .npz 列式格式保存/加载往返：倒排数组、元数据与检索结果一致"""
+    print("\n" + "=" * 50)
+    print("7. 测试倒排索引 .npz 保存/加载")
+    print("=" * 50)
+
+    import tempfile
+    import numpy as np
+    from modules.index import InvertedIndex
+
+    index, documents = _build_test_index()
+    queries = ["早餐，服务，位置", "隔音，景观", "不存在的词"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = str(Path(tmp_dir) / "index.npz")
+        index.save(filepath)
+
+        loaded = InvertedIndex()
+        loaded.load(filepath)
+        assert loaded.vocab == index.vocab
+        assert loaded.doc_ids == index.doc_ids
+        assert loaded.documents == documents
+        assert (loaded.k1, loaded.b, loaded.num_docs) == (index.k1, index.b, index.num_docs)
+        assert loaded.avg_doc_length == index.avg_doc_length
+        for name in ('term_offsets', 'posting_doc_idxs', 'posting_tfs', 'posting_weights',
+                     'doc_lengths', 'idf', 'max_score'):
+            assert np.array_equal(getattr(loaded, name), getattr(index, name)), name
+        assert loaded.version > 0
+        for query in queries:
+            assert loaded.search(query, topk=20) == index.search(query, topk=20)
+
+        stripped = InvertedIndex()
+        stripped.load(filepath, keep_documents=False)
+        assert stripped.documents == {}
+        assert stripped.search(queries[0], topk=20) == index.search(queries[0], topk=20)
+    print("  ✅ 往返后倒排数组与检索结果一致")
+
+
 if __name__ == "__main__":
     success = test_imports()
+    test_intent_rules()
+    test_bm25_search()
+    test_answer_cache()
+    test_retrieval_cache()
+    test_index_npz_roundtrip()
 
     if success and "--full" in sys.argv:
         test_rag_system()
@@ -1,13 +1,60 @@
 """Insforge 数据库连接工具"""
 
 import os
+import re
+import json
 import pandas as pd
 import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson 解析速度更快，未安装时回退标准库
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Content-Range 响应头中的总条数，如 "0-999/12345"
+_TOTAL_PATTERN = re.compile(r'/(\d+)\s*$')
+
+# 取值有限的文本列存为 category，计数类整数列按取值范围收窄
+_CATEGORY_COLUMNS = ('room_type', 'fuzzy_room_type', 'travel_type')
+_INTEGER_COLUMNS = ('star', 'useful_count', 'review_count', 'quality_score')
+
+
+def _fetch_page(session: requests.Session, url: str, headers: dict, offset: int, batch_size: int):
+    """按 Range 分页获取一页评论，返回 (数据, 响应)"""
+    range_headers = {
+        **headers,
+        "Range-Unit": "items",
+        "Range": f"{offset}-{offset + batch_size - 1}",
+        "Prefer": "count=exact"
+    }
+    response = session.get(url, headers=range_headers)
+
+    if response.status_code not in (200, 206):
+        raise RuntimeError(f"Insforge API 调用失败: {response.status_code} {response.text}")
+
+    return _json_loads(response.content), response
+
+
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """收窄列类型：房型等低基数列转 category，整数列向下转型（含缺失值的列推断为浮点，保持原样）"""
+    for col in _CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in _INTEGER_COLUMNS:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
 
 
-def get_all_comments_from_insforge() -> pd.DataFrame:
+def get_all_comments_from_insforge(workers: int = 8) -> pd.DataFrame:
     """从 Insforge 数据库获取所有评论数据
 
+    首页响应的 Content-Range 给出总条数后，其余分页并发请求并按偏移顺序拼接；
+    拿不到总条数时逐页顺序获取
+
     返回:
         pandas.DataFrame: 评论数据，以 _id 为索引
     """
@@ -23,39 +70,41 @@ def get_all_comments_from_insforge() -> pd.DataFrame:
         "Content-Type": "application/json"
     }
 
-    all_data = []
+    # Insforge SDK 使用 /api/database/records/{table} 端点
+    # PostgREST 风格查询参数: select=*, Range header 分页
+    url = f"{base_url}/api/database/records/comments?select=*"
     batch_size = 1000
-    offset = 0
 
     print("正在从 Insforge 数据库获取评论数据...")
 
-    while True:
-        # Insforge SDK 使用 /api/database/records/{table} 端点
-        # PostgREST 风格查询参数: select=*, Range header 分页
-        url = f"{base_url}/api/database/records/comments?select=*"
-        range_headers = {
-            **headers,
-            "Range-Unit": "items",
-            "Range": f"{offset}-{offset + batch_size - 1}",
-            "Prefer": "count=exact"
-        }
-        response = requests.get(url, headers=range_headers)
-
-        if response.status_code not in (200, 206):
-            raise RuntimeError(f"Insforge API 调用失败: {response.status_code} {response.text}")
-
-        data = response.json()
-        if not data:
-            break
-
-        all_data.extend(data)
+    with requests.Session() as session:
+        data, response = _fetch_page(session, url, headers, 0, batch_size)
+        all_data = list(data)
         print(f"  已获取 {len(all_data)} 条评论...")
 
-        if len(data) < batch_size:
-            break
-        offset += batch_size
-
-    df = pd.DataFrame(all_data)
+        match = _TOTAL_PATTERN.search(response.headers.get("Content-Range", ""))
+        if len(data) == batch_size and match:
+            offsets = range(batch_size, int(match.group(1)), batch_size)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='insforge') as executor:
+                pages = executor.map(lambda offset: _fetch_page(session, url, headers, offset, batch_size)[0], offsets)
+                for page in pages:
+                    all_data.extend(page)
+                    print(f"  已获取 {len(all_data)} 条评论...")
+        elif len(data) == batch_size:
+            offset = batch_size
+            while True:
+                data, _ = _fetch_page(session, url, headers, offset, batch_size)
+                if not data:
+                    break
+
+                all_data.extend(data)
+                print(f"  已获取 {len(all_data)} 条评论...")
+
+                if len(data) < batch_size:
+                    break
+                offset += batch_size
+
+    df = _compact_dtypes(pd.DataFrame.from_records(all_data))
 
     if '_id' in df.columns:
         df.set_index('_id', inplace=True)
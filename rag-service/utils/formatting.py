@@ -1,5 +1,33 @@
 """格式化输出函数"""
 
+_ROUTE_NAMES = {'bm25': '文本', 'vector': '向量', 'reverse': '反向', 'hyde': 'HyDE'}
+
+
+def _format_route_ranks(route_ranks: dict) -> list[str]:
+    """
+    召回路由明细：各路按最佳名次排序，路内命中按 (名次, Query, HyDE) 排序
+
+    全部命中展平后一次排序，按路由首次出现的顺序归组，不改动传入的命中列表
+    """
+    route_order = {route: i for i, route in enumerate(route_ranks)}
+    flat = sorted(
+        ((hit['rank'], route_order[route], hit['metadata'].get('query_idx', 0),
+          hit['metadata'].get('hyde_idx', 0), route, hit)
+         for route, hits in route_ranks.items() for hit in hits),
+        key=lambda x: x[:4]
+    )
+
+    grouped = {}
+    for *_, route, hit in flat:
+        q_idx = hit['metadata'].get('query_idx', '?')
+        if route == 'hyde':
+            info_str = f"第{hit['rank']}名(Q{q_idx}-H{hit['metadata'].get('hyde_idx', '?')})"
+        else:
+            info_str = f"第{hit['rank']}名(Q{q_idx})"
+        grouped.setdefault(route, []).append(info_str)
+
+    return [f"    • {_ROUTE_NAMES.get(route, route)}: {', '.join(hit_strs)}" for route, hit_strs in grouped.items()]
+
 
 def print_retrieval_results(results):
     """格式化打印召回结果"""
@@ -47,28 +75,8 @@ def print_retrieval_results(results):
             print(f"  内容: {comment['comment']}")
 
             print(f"  召回路由:")
-            route_list = []
-            for route, hits in comment['route_ranks'].items():
-                if not hits:
-                    continue
-                best_rank_in_route = min(hit['rank'] for hit in hits)
-                route_list.append((best_rank_in_route, route, hits))
-            route_list.sort(key=lambda x: x[0])
-
-            for _, route, hits in route_list:
-                route_name = {'bm25': '文本', 'vector': '向量', 'reverse': '反向', 'hyde': 'HyDE'}.get(route, route)
-                hits.sort(key=lambda x: (x['rank'], x['metadata'].get('query_idx', 0), x['metadata'].get('hyde_idx', 0)))
-                hit_strs = []
-                for hit in hits:
-                    rank = hit['rank']
-                    q_idx = hit['metadata'].get('query_idx', '?')
-                    info_str = f"第{rank}名(Q{q_idx}"
-                    if route == 'hyde':
-                        h_idx = hit['metadata'].get('hyde_idx', '?')
-                        info_str += f"-H{h_idx}"
-                    info_str += ")"
-                    hit_strs.append(info_str)
-                print(f"    • {route_name}: {', '.join(hit_strs)}")
+            for line in _format_route_ranks(comment['route_ranks']):
+                print(line)
     else:
         print(f"\n🏆 未召回评论")
 
@@ -164,27 +172,7 @@ def print_rag_result(result: dict):
             print(f"  内容: {comment['comment']}")
 
             print(f"  召回路由:")
-            route_list = []
-            for route, hits in comment['route_ranks'].items():
-                if not hits:
-                    continue
-                best_rank_in_route = min(hit['rank'] for hit in hits)
-                route_list.append((best_rank_in_route, route, hits))
-            route_list.sort(key=lambda x: x[0])
-
-            for _, route, hits in route_list:
-                route_name = {'bm25': '文本', 'vector': '向量', 'reverse': '反向', 'hyde': 'HyDE'}.get(route, route)
-                hits.sort(key=lambda x: (x['rank'], x['metadata'].get('query_idx', 0), x['metadata'].get('hyde_idx', 0)))
-                hit_strs = []
-                for hit in hits:
-                    rank = hit['rank']
-                    q_idx = hit['metadata'].get('query_idx', '?')
-                    info_str = f"第{rank}名(Q{q_idx}"
-                    if route == 'hyde':
-                        h_idx = hit['metadata'].get('hyde_idx', '?')
-                        info_str += f"-H{h_idx}"
-                    info_str += ")"
-                    hit_strs.append(info_str)
-                print(f"    • {route_name}: {', '.join(hit_strs)}")
+            for line in _format_route_ranks(comment['route_ranks']):
+                print(line)
     else:
         print(f"\n🏆 未召回评论")